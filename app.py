@@ -1,188 +1,219 @@
-from flask import Flask, request, session, redirect, render_template, render_template_string, flash, get_flashed_messages
-from flask_socketio import SocketIO, emit, join_room, leave_room
-from werkzeug.security import generate_password_hash
-import sqlite3, random, time
-
-app = Flask(__name__)
+from flask import Flask, Response, abort, request, session, redirect, render_template, stream_template, flash
+from flask_socketio import SocketIO, emit
+import functools, json, logging, os, sqlite3, random, threading, time
+
+from assets import AssetPipeline
+from blocking import run_blocking
+from cache import LRUCache
+from counters import apply_counter_drift, counter_drift, read_counters
+from broker import socketio_options
+from db import Database
+from export import EXPORT_COLUMNS, FORMATS
+from history import MessageHistory, ReconnectGrace
+from logs import log_event, logger
+from matchmaker import Matchmaker, SqliteMatchmaker
+from metrics import RecentEvents, Registry
+from migrations import migrate
+from passwords import DEFAULT_METHOD, PasswordHasher
+from profiling import Profiler
+from ratelimit import RateLimiter, TypingCoalescer
+from rooms import AlreadyPaired, RoomRegistry, SqliteRoomRegistry
+from sessions import MemorySessionStore, ServerSession, ServerSessionInterface, SqliteSessionStore
+
+# Scaling out: point every worker at the same queue (redis://..., or memory://
+# for the in-process stand-in) and the same waiting pool ('sqlite' shares it
+# between all workers on this host).
+MESSAGE_QUEUE = os.environ.get('CHAT_MESSAGE_QUEUE')
+MATCHMAKER = os.environ.get('CHAT_MATCHMAKER', 'local')
+# threading, gevent or eventlet. Never left to Flask-SocketIO to pick: with
+# gevent installed it would choose gevent even when nothing monkey-patched
+# the standard library, and every sqlite call would block the hub. Start the
+# server through wsgi.py so the cooperative modes get patched first.
+ASYNC_MODE = os.environ.get('CHAT_ASYNC_MODE', 'threading')
+# Where session data lives: 'memory' (per worker), 'sqlite' (shared by the
+# workers on this host) or 'cookie' for Flask's signed-cookie sessions
+SESSION_BACKEND = os.environ.get('CHAT_SESSION_BACKEND', 'memory')
+# Per-event lines (join, match, skip...) are DEBUG; CHAT_LOG_SAMPLE keeps
+# only that fraction of them when they are switched on
+LOG_LEVEL = os.environ.get('CHAT_LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE = float(os.environ.get('CHAT_LOG_SAMPLE', 1.0))
+logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s %(message)s')
+logger.setLevel(LOG_LEVEL)
+
+app = Flask(__name__, static_folder=None)
 app.secret_key = 'your_very_secure_secret'
-socketio = SocketIO(app, manage_session=False)
-DB_NAME = 'db.sqlite'
-
-# ---------- Layout Wrapper Function ----------
-def render_with_layout(title, body_html, **kwargs):
-    layout = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>{title}</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-        <style>
-            body {{ padding: 30px; }}
-            nav a {{ margin-right: 15px; }}
-        </style>
-    </head>
-    <body>
-        <nav class="navbar navbar-expand-lg navbar-dark bg-dark mb-4">
-            <div class="container-fluid">
-                <a class="navbar-brand" href="/admin">Admin Panel</a>
-                <div class="navbar-nav">
-                    <a class="nav-link" href="/admin">Dashboard</a>
-                    <a class="nav-link" href="/admin/users">Users Manage</a>
-                    <a class="nav-link" href="/admin/preferences">Preferences</a>
-                </div>
-            </div>
-        </nav>
-        <div class="container">
-            {body_html}
-        </div>
-    </body>
-    </html>
-    """
-    return render_template_string(layout, **kwargs)
+assets = AssetPipeline(os.path.join(app.root_path, 'static'))
+assets.init_app(app)
+socketio = SocketIO(app, manage_session=False, async_mode=ASYNC_MODE, **socketio_options(MESSAGE_QUEUE))
+DB_NAME = os.environ.get('CHAT_DB', 'db.sqlite')
+MATCHMAKER_DB_NAME = 'matchmaking.sqlite'
+SESSION_DB_NAME = 'sessions.sqlite'
+db = Database(DB_NAME)
+
+# ---------- Metrics ----------
+# Per process, in the Prometheus text format on /metrics
+metrics = Registry()
+DB_SECONDS = metrics.histogram('chat_db_seconds', "Time spent in sqlite, by call site", ['site'])
+HANDLER_SECONDS = metrics.histogram('chat_handler_seconds', "Socket.IO handler latency", ['handler'])
+TIME_TO_MATCH = metrics.histogram('chat_time_to_match_seconds', "How long the matched partner had been waiting")
+MATCHES = metrics.counter('chat_matches_total', "Strangers paired up")
+MESSAGES = metrics.counter('chat_messages_total', "Chat messages relayed")
+# For the admin dashboard, which has no Prometheus to compute rates for it
+recent_messages = RecentEvents(60)
+
+def observe_db(site, seconds):
+    DB_SECONDS.labels(site).observe(seconds)
+
+db.on_timing = observe_db
+
+# Every view and Socket.IO handler runs through this; off until switched on
+# from /admin/profile
+profiler = Profiler()
+
+_background_lock = threading.Lock()
+_background_tasks = {}
+
+def keep_running(target):
+    # One error (say "database is locked") must not stop a sweeper for good
+    while True:
+        try:
+            target()
+        except Exception:
+            logger.exception("background task %s failed; restarting", target.__name__)
+            socketio.sleep(1)
+
+def start_background_task_once(target):
+    # Sweepers are started on first use rather than at import, so importing
+    # app (tools, benchmarks) never spawns threads
+    if target not in _background_tasks:
+        with _background_lock:
+            if target not in _background_tasks:
+                _background_tasks[target] = socketio.start_background_task(keep_running, target)
+
+# ---------- Sessions ----------
+if SESSION_BACKEND == 'sqlite':
+    session_db = Database(SESSION_DB_NAME)
+    session_db.on_timing = observe_db
+    session_store = SqliteSessionStore(session_db)
+elif SESSION_BACKEND == 'memory':
+    session_store = MemorySessionStore()
+else:
+    session_store = None
+
+SESSION_SWEEP_INTERVAL = 60
+
+def session_sweeper():
+    while True:
+        socketio.sleep(SESSION_SWEEP_INTERVAL)
+        session_store.sweep()
+
+if session_store is not None:
+    app.session_interface = ServerSessionInterface(session_store)
+
+    @app.before_request
+    def start_session_sweeper():
+        start_background_task_once(session_sweeper)
+
+# ---------- Templates ----------
+_static_pages = {}
+
+def static_page(name, **context):
+    # Pages with no per-request data are rendered once and served as bytes
+    body = _static_pages.get(name)
+    if body is None or app.debug:
+        body = _static_pages[name] = render_template(name, **context).encode()
+    return Response(body, mimetype='text/html')
+
+def compile_templates():
+    # Parse and compile everything up front instead of on the first request
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+compile_templates()
 
 # --- DATABASE INITIALIZATION ---
 def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            email TEXT,
-            phone TEXT,
-            is_admin INTEGER DEFAULT 0
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS preferences (
-            user_id INTEGER,
-            category TEXT,
-            preference TEXT
-        )''')
-        conn.commit()
+    with db.connection('migrate') as conn:
+        migrate(conn)
 
 init_db()
 
 # --- AUTH / UTILS ---
 ADMIN_CREDENTIALS = {'username': 'admin', 'password': 'admin123'}
 
+# Work factor as a werkzeug method string; accounts hashed with anything else
+# are rehashed the next time they log in
+PASSWORD_METHOD = os.environ.get('CHAT_PASSWORD_METHOD', DEFAULT_METHOD)
+PASSWORD_WORKERS = int(os.environ.get('CHAT_PASSWORD_WORKERS', 0)) or None
+passwords = PasswordHasher(PASSWORD_METHOD, PASSWORD_WORKERS)
+
 def get_user():
     return session.get('user_id')
 
+USER_PREFERENCES_QUERY = "SELECT category, preference FROM preferences WHERE user_id=?"
+
 def get_user_preferences(uid):
-    with sqlite3.connect(DB_NAME) as conn:
+    with db.connection('get_user_preferences') as conn:
         c = conn.cursor()
-        c.execute("SELECT category, preference FROM preferences WHERE user_id=?", (uid,))
+        c.execute(USER_PREFERENCES_QUERY, (uid,))
         data = {}
         for category, pref in c.fetchall():
             data.setdefault(category, []).append(pref)
         return data
 
-def get_preference_suggestions():
-    with sqlite3.connect(DB_NAME) as conn:
+# Matching only needs a user's preferences as their sorted tags.id values,
+# which are stable and shared by every worker; keep the most recently used ones in memory so repeated joins and skips never hit
+# sqlite. Every write to a user's preferences must invalidate their entry;
+# that only reaches this worker's cache, so entries also expire after
+# PREFERENCE_CACHE_TTL seconds and other workers pick up the change then.
+PREFERENCE_CACHE_SIZE = int(os.environ.get('CHAT_PREFERENCE_CACHE', 100000))
+PREFERENCE_CACHE_TTL = float(os.environ.get('CHAT_PREFERENCE_CACHE_TTL', 60))
+preference_cache = LRUCache(PREFERENCE_CACHE_SIZE, ttl=PREFERENCE_CACHE_TTL)
+
+USER_TAG_IDS_QUERY = """SELECT t.id FROM preferences p
+    JOIN tags t ON t.category = p.category AND t.preference = p.preference
+    WHERE p.user_id=? ORDER BY t.id"""
+
+def load_user_tag_ids(uid):
+    with db.connection('get_user_tag_ids') as conn:
+        return tuple(tag_id for (tag_id,) in conn.execute(USER_TAG_IDS_QUERY, (uid,)))
+
+def get_user_tag_ids(uid):
+    tag_ids = preference_cache.get(uid)
+    if tag_ids is None:
+        tag_ids = run_blocking(load_user_tag_ids, uid)
+        preference_cache.set(uid, tag_ids)
+    return tag_ids
+
+def save_user_preferences(uid, tags):
+    # Only touch the rows that changed, all in one transaction
+    tags = set(tags)
+    with db.connection('save_user_preferences') as conn:
         c = conn.cursor()
-        c.execute("SELECT category, preference, COUNT(*) FROM preferences GROUP BY category, preference ORDER BY COUNT(*) DESC")
-        return c.fetchall()
-
-def match_user_by_preferences(user_prefs, exclude_id=None):
-    with sqlite3.connect(DB_NAME) as conn:
+        c.execute(USER_PREFERENCES_QUERY, (uid,))
+        stored = set(c.fetchall())
+        c.executemany("DELETE FROM preferences WHERE user_id=? AND category=? AND preference=?",
+                      [(uid, cat, pref) for cat, pref in stored - tags])
+        c.executemany("INSERT OR IGNORE INTO preferences (user_id, category, preference) VALUES (?, ?, ?)",
+                      [(uid, cat, pref) for cat, pref in tags - stored])
+    preference_cache.invalidate(uid)
+
+SUGGESTION_LIMIT = 50
+# tags.user_count is kept current by triggers on preferences, so this is a
+# top-N walk of the tags_user_count index rather than a GROUP BY
+SUGGESTIONS_QUERY = "SELECT category, preference, user_count FROM tags WHERE user_count > 0 ORDER BY user_count DESC LIMIT ?"
+
+def get_preference_suggestions(limit=SUGGESTION_LIMIT):
+    with db.connection('preference_suggestions') as conn:
         c = conn.cursor()
-        scores = {}
-        for category, prefs in user_prefs.items():
-            for pref in prefs:
-                c.execute("SELECT user_id FROM preferences WHERE category=? AND preference=?", (category, pref))
-                for (uid,) in c.fetchall():
-                    if uid == exclude_id:
-                        continue
-                    scores[uid] = scores.get(uid, 0) + 1
-        return sorted(scores, key=scores.get, reverse=True)
+        c.execute(SUGGESTIONS_QUERY, (limit,))
+        return c.fetchall()
 
 @app.route('/')
 def home():
     session.clear()  # Restart everything on refresh
     return redirect('/captcha')
 
-BASE_LAYOUT_TEMPLATE = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>{{ title or "Chat Chat"  }}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        * { box-sizing: border-box; }
-        body {
-            background: linear-gradient(to right, #0f2027, #203a43, #2c5364);
-            font-family: Arial, sans-serif;
-            color: white;
-            text-align: center;
-            margin: 0;
-            padding: 40px;
-        }
-        .container {
-            animation: fadeIn 0.8s ease;
-            background: rgba(0,0,0,0.6);
-            padding: 30px;
-            border-radius: 10px;
-            max-width: 500px;
-            margin: auto;
-        }
-        form {
-            display: flex;
-            flex-direction: column;
-            gap: 15px;
-        }
-        input, button {
-            padding: 10px;
-            border-radius: 5px;
-            border: none;
-            font-size: 16px;
-        }
-        input {
-            background: #333;
-            color: white;
-            border: 1px solid #555;
-        }
-        button {
-            background: #2a9df4;
-            color: white;
-            cursor: pointer;
-        }
-        button:disabled {
-            background: #777;
-            cursor: not-allowed;
-        }
-        .error {
-            color: #ff6666;
-            font-weight: bold;
-        }
-        a {
-            color: #aad4ff;
-            text-decoration: none;
-        }
-        a:hover {
-            text-decoration: underline;
-        }
-        @keyframes fadeIn {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        @keyframes shake {
-            0% { transform: translateX(0); }
-            25% { transform: translateX(-5px); }
-            50% { transform: translateX(5px); }
-            75% { transform: translateX(-5px); }
-            100% { transform: translateX(0); }
-        }
-        .shake {
-            animation: shake 0.4s;
-        }
-    </style>
-</head>
-<body>
-    <div class="container {{ extra_class|default('') }}">
-        {{ content|safe }}
-    </div>
-</body>
-</html>
-'''
-
 # Define the CAPTCHA questions
 CAPTCHA_QUESTIONS = [
     {"question": "What color is the sky on a clear sunny day?", "answer": "blue"},
@@ -207,6 +238,7 @@ def captcha():
     if session.get("verified"):
         return redirect('/verify')
     error = None
+    hint = False
     if request.method == "POST":
         user_answer = request.form.get("captcha", "").strip().lower()
         expected_answer = session.get("captcha_answer", "").lower()
@@ -217,61 +249,32 @@ def captcha():
             return redirect("/verify")
         else:
             error = "Incorrect answer. Please try again."
-            if session['captcha_attempts'] >= 2:
-                error += " <br><small>Hint: Keep it simple and literal (e.g. 'blue', '4').</small>"
+            hint = session['captcha_attempts'] >= 2
 
     # Ask a new question if it's a GET request or answer was wrong
     question_obj = get_random_captcha()
     session["captcha_answer"] = question_obj["answer"]
 
-    CAPTCHA_TEMPLATE = f'''
-    <h3>Verify you are human</h3>
-    <p>{question_obj["question"]}</p>
-    <form method="POST">
-        <input name="captcha" placeholder="Answer" required>
-        <button type="submit">Verify</button>
-        {"<p style='color:red'>" + error + "</p>" if error else ""}
-    </form>
-    '''
-    return render_template_string(BASE_LAYOUT_TEMPLATE, title="CAPTCHA", content=CAPTCHA_TEMPLATE, extra_class='shake')
+    return render_template('captcha.html', question=question_obj["question"], error=error, hint=hint, extra_class='shake')
 
 @app.route('/chat')
 def chat():
     if not session.get("human_verified"):
         return redirect("/captcha")  # Ensure CAPTCHA passed
-    return render_template_string(CHAT_TEMPLATE, user_id=session.get('user_id'))
+    return render_template('chat.html', user_id=session.get('user_id'))
 
 @app.route('/verify', methods=['GET', 'POST'])
 def verify():
     if not session.get('human_verified'):
         return redirect('/captcha')
-    error_html = ''
-    extra_class = ''
+    error = False
     if request.method == 'POST':
         if request.form.get('age_confirm') == 'on':
             session['age_verified'] = True
             return redirect('/auth')
         else:
-            error_html = "<p class='error'>You must confirm you are 18+ to continue.</p>"
-            extra_class = 'shake'
-    AGE_TEMPLATE = '''
-        <h3>Are you 18 or older?</h3>
-        <form method="POST">
-            <label>
-                <input type="checkbox" id="age_confirm" name="age_confirm" onchange="toggleButton()"> I confirm I am 18+
-            </label><br><br>
-            <button type="submit" id="continueBtn" disabled>Continue</button>
-        </form>
-
-    <script>
-        function toggleButton() {{
-            const checkbox = document.getElementById('age_confirm');
-            const button = document.getElementById('continueBtn');
-            button.disabled = !checkbox.checked;
-        }}
-    </script>
-    '''.format(error=error_html)
-    return render_template_string(BASE_LAYOUT_TEMPLATE, title="Age Verification", content=AGE_TEMPLATE, extra_class=extra_class )
+            error = True
+    return render_template('verify.html', error=error, extra_class='shake' if error else '')
 
 @app.route('/auth', methods=['GET', 'POST'])
 def auth():
@@ -285,7 +288,18 @@ def auth():
             return redirect('/login')
         elif action == 'register':
             return redirect('/register')
-    return render_template_string(BASE_LAYOUT_TEMPLATE, title="Auth", content=AUTH_TEMPLATE, extra_class='shake')
+    return static_page('auth.html', extra_class='shake')
+
+def sign_in(user_id, is_admin=False):
+    # A new id whenever privileges change, so an id planted in the browser
+    # before login (session fixation) is worthless after it
+    if isinstance(session, ServerSession):
+        session.regenerate()
+    session['user_id'] = user_id
+    if is_admin:
+        session['is_admin'] = True
+
+LOGIN_QUERY = "SELECT id, password FROM users WHERE username=?"
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -293,17 +307,20 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         if username == ADMIN_CREDENTIALS['username'] and password == ADMIN_CREDENTIALS['password']:
-            session['user_id'] = -1
-            session['is_admin'] = True
+            sign_in(-1, is_admin=True)
             return redirect('/admin')
-        with sqlite3.connect(DB_NAME) as conn:
+        with db.connection('login') as conn:
             c = conn.cursor()
-            c.execute("SELECT id FROM users WHERE username=?", (username,))
+            c.execute(LOGIN_QUERY, (username,))
             user = c.fetchone()
-            if user:
-                session['user_id'] = user[0]
-                return redirect('/chat')
-    return render_template_string(BASE_LAYOUT_TEMPLATE, title="Login", content=LOGIN_TEMPLATE, extra_class='shake')
+        if user and passwords.verify(user[1], password):
+            if passwords.needs_rehash(user[1]):
+                rehashed = passwords.hash(password)
+                with db.connection('login') as conn:
+                    conn.execute("UPDATE users SET password=? WHERE id=?", (rehashed, user[0]))
+            sign_in(user[0])
+            return redirect('/chat')
+    return static_page('login.html', extra_class='shake')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -312,15 +329,22 @@ def register():
         email = request.form.get('email')
         phone = request.form.get('phone')
         password = request.form.get('password')
-        hashed_pw = generate_password_hash(password)
-
-        with sqlite3.connect(DB_NAME) as conn:
-            c = conn.cursor()
-            c.execute("INSERT INTO users (username, email, phone, password) VALUES (?, ?, ?, ?)", (username, email, phone, hashed_pw))
-            uid = c.lastrowid
-            session['user_id'] = uid
+        if not username:
+            return render_template('register.html', error="Choose a username.", extra_class='shake')
+        if not password:
+            return render_template('register.html', error="Choose a password.", extra_class='shake')
+        hashed_pw = passwords.hash(password)
+
+        try:
+            with db.connection('register') as conn:
+                c = conn.cursor()
+                c.execute("INSERT INTO users (username, email, phone, password) VALUES (?, ?, ?, ?)", (username, email, phone, hashed_pw))
+                uid = c.lastrowid
+        except sqlite3.IntegrityError:
+            return render_template('register.html', error="That username is already taken.", extra_class='shake')
+        sign_in(uid)
         return redirect('/preferences')
-    return render_template_string(BASE_LAYOUT_TEMPLATE, title="Register", content=REGISTER_TEMPLATE, extra_class='shake')
+    return static_page('register.html', extra_class='shake')
 
 @app.route('/preferences', methods=['GET', 'POST'])
 def preferences():
@@ -328,27 +352,22 @@ def preferences():
     if not uid:
         return redirect('/login')
     if request.method == 'POST':
-        with sqlite3.connect(DB_NAME) as conn:
-            c = conn.cursor()
-            c.execute("DELETE FROM preferences WHERE user_id=?", (uid,))
-            for category, pref_list in request.form.lists():
-                if category == "custom":
-                    continue  # We'll handle it separately
-                for pref in pref_list:
-                    c.execute("INSERT INTO preferences (user_id, category, preference) VALUES (?, ?, ?)",
-                              (uid, category, pref))
-
-            # Handle custom preferences (comma separated)
-            custom_input = request.form.get("custom", "").strip()
-            if custom_input:
-                custom_prefs = [p.strip() for p in custom_input.split(",") if p.strip()]
-                for cpref in custom_prefs:
-                    c.execute("INSERT INTO preferences (user_id, category, preference) VALUES (?, ?, ?)",
-                              (uid, 'custom', cpref))
+        submitted = set()
+        for category, pref_list in request.form.lists():
+            if category == "custom":
+                continue  # We'll handle it separately
+            submitted.update((category, pref) for pref in pref_list)
+
+        # Handle custom preferences (comma separated)
+        custom_input = request.form.get("custom", "").strip()
+        if custom_input:
+            submitted.update(('custom', p.strip()) for p in custom_input.split(",") if p.strip())
+
+        save_user_preferences(uid, submitted)
         flash("Preferences saved! Connecting you to a match...")
         return redirect('/chat')
     suggestions = get_preference_suggestions()
-    return render_template_string(BASE_LAYOUT_TEMPLATE, title="Preferences", content=PREFERENCES_TEMPLATE, suggestions=suggestions, extra_class='shake')
+    return render_template('preferences.html', suggestions=suggestions, extra_class='shake')
 
 # ---------- Admin Check ----------
 def is_admin():
@@ -359,449 +378,489 @@ def is_admin():
 def admin_dashboard():
     if not is_admin():
         return "Unauthorized", 403
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM users")
-        user_count = c.fetchone()[0]
-        c.execute("SELECT COUNT(DISTINCT user_id) FROM preferences")
-        pref_users = c.fetchone()[0]
-    body = """
-    <h2>Dashboard Overview</h2>
-    <div class="row">
-        <div class="col-md-6">
-            <div class="card text-bg-primary mb-3">
-                <div class="card-body">
-                    <h5 class="card-title">Total Users</h5>
-                    <p class="card-text display-6">{{ user_count }}</p>
-                </div>
-            </div>
-        </div>
-        <div class="col-md-6">
-            <div class="card text-bg-success mb-3">
-                <div class="card-body">
-                    <h5 class="card-title">Users with Preferences</h5>
-                    <p class="card-text display-6">{{ pref_users }}</p>
-                </div>
-            </div>
-        </div>
-    </div>
-    """
-    return render_with_layout("Admin Dashboard", body, user_count=user_count, pref_users=pref_users)
+    with db.connection('admin_dashboard') as conn:
+        counts = read_counters(conn)
+    live = {'connections': len(connected_users), 'messages_per_minute': recent_messages.total()}
+    if MATCHMAKER == 'sqlite':
+        # Counting the shared pool and rooms means scanning their tables on
+        # every view, so only this worker's own numbers are shown; /metrics
+        # has the totals
+        matchmaking = {'time_to_match': matchmaker.waits.percentiles()}
+    else:
+        live['rooms'] = len(rooms)
+        matchmaking = matchmaker.stats()
+    return render_template('admin/dashboard.html', user_count=counts.get('users', 0),
+                           pref_users=counts.get('preference_users', 0), live=live,
+                           matchmaking=matchmaking, preference_cache=preference_cache.stats())
+
+# The dashboard counters are kept by triggers; recount them now and then in
+# case something went around them
+COUNTER_RECONCILE_INTERVAL = float(os.environ.get('CHAT_COUNTER_RECONCILE', 3600))
+
+def reconcile_dashboard_counters():
+    # The counts can take a while on a big table; a read transaction keeps
+    # them consistent with the counters without holding the write lock, and
+    # the fix is a short write of its own
+    with db.connection('reconcile_counters') as conn:
+        conn.execute("BEGIN")
+        drift = counter_drift(conn)
+        conn.commit()
+        apply_counter_drift(conn, drift)
+    return drift
+
+def counter_reconciler():
+    while True:
+        socketio.sleep(COUNTER_RECONCILE_INTERVAL)
+        for name, (stored, actual) in run_blocking(reconcile_dashboard_counters).items():
+            log_event(logging.WARNING, 'counter_drift', counter=name, stored=stored, actual=actual)
+
+@app.before_request
+def start_counter_reconciler():
+    start_background_task_once(counter_reconciler)
+
+# Admin listings page with keyset cursors (the sort key of the last row
+# shown, JSON-encoded in ?after=) so every page is an index range scan no
+# matter how deep it is. ?stream=1 instead renders every matching row
+# straight from the cursor, and /admin/export/ streams them as CSV or
+# NDJSON; either way memory use stays flat however big the table is.
+ADMIN_PAGE_SIZE = 100
+ADMIN_MAX_PAGE_SIZE = 1000
+
+def admin_cursor(size):
+    # The sort key of the last row shown, a JSON list of `size` values
+    raw = request.args.get('after')
+    if not raw:
+        return None
+    try:
+        after = json.loads(raw)
+    except ValueError:
+        abort(400)
+    if not isinstance(after, list) or len(after) != size:
+        abort(400)
+    return after
+
+def admin_page_size():
+    return max(1, min(request.args.get('limit', ADMIN_PAGE_SIZE, type=int), ADMIN_MAX_PAGE_SIZE))
+
+def prefix_range(prefix):
+    # username LIKE 'ab%' as an index range: 'ab' <= username < 'ac'. The
+    # upper bound is None when there is none ('\U0010ffff' has no successor)
+    stem = prefix.rstrip('\U0010ffff')
+    if not stem:
+        return prefix, None
+    code = ord(stem[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000  # surrogates can't be bound as text
+    return prefix, stem[:-1] + chr(code)
+
+def users_query(prefix, after):
+    # Usernames are unique but may be NULL (bulk imports), so the cursor is
+    # [username, id]; NULLs sort first and are paged by id
+    where, params = [], []
+    if prefix:
+        low, high = prefix_range(prefix)
+        where.append("username >= ?")
+        params.append(low)
+        if high is not None:
+            where.append("username < ?")
+            params.append(high)
+    if after is not None:
+        username, uid = after
+        if username is None:
+            where.append("(username IS NULL AND id > ? OR username IS NOT NULL)")
+            params.append(uid)
+        else:
+            where.append("username > ?")
+            params.append(username)
+    sql = "SELECT id, username, email, phone FROM users"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY username, id", params
+
+def preferences_query(category, after):
+    if category:
+        sql = "SELECT user_id, category, preference FROM preferences WHERE category = ?"
+        params = [category]
+        if after is not None:
+            sql += " AND (preference, user_id) > (?, ?)"
+            params.extend(after)
+        return sql + " ORDER BY preference, user_id", params
+    sql, params = "SELECT user_id, category, preference FROM preferences", []
+    if after is not None:
+        sql += " WHERE (user_id, category, preference) > (?, ?, ?)"
+        params.extend(after)
+    return sql + " ORDER BY user_id, category, preference", params
+
+def admin_listing(template, sql, params, cursor_of, **context):
+    if request.args.get('stream'):
+        return Response(stream_template(template, rows=db.stream(sql, params, site='admin_listing'), next_after=None, **context))
+    limit = admin_page_size()
+    with db.connection('admin_listing') as conn:
+        rows = conn.execute(sql + " LIMIT ?", params + [limit]).fetchall()
+    next_after = json.dumps(cursor_of(rows[-1])) if len(rows) == limit else None
+    return render_template(template, rows=rows, next_after=next_after, **context)
 
 @app.route('/admin/users')
 def admin_users():
     if not is_admin():
         return "Unauthorized", 403
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute("SELECT id, username, email, phone FROM users")
-        users = c.fetchall()
-    body = """
-    <h2>User Management</h2>
-    <table class="table table-striped">
-        <thead><tr><th>Username</th><th>Email</th><th>Phone</th><th>Action</th></tr></thead>
-        <tbody>
-        {% for user in users %}
-        <tr>
-            <td>{{ user[1] }}</td>
-            <td>{{ user[2] }}</td>
-            <td>{{ user[3] }}</td>
-            <td>
-                <form action="/admin/delete_user/{{ user[0] }}" method="post" onsubmit="return confirm('Delete this user?');">
-                    <button type="submit" class="btn btn-sm btn-danger">Delete</button>
-                </form>
-            </td>
-        </tr>
-        {% endfor %}
-        </tbody>
-    </table>
-    """
-    return render_with_layout("User Management", body, users=users)
+    prefix = request.args.get('prefix', '')
+    sql, params = users_query(prefix, admin_cursor(2))
+    return admin_listing('admin/users.html', sql, params, lambda row: [row[1], row[0]], prefix=prefix)
 
 @app.route('/admin/delete_user/<int:user_id>', methods=['POST'])
 def delete_user(user_id):
     if not is_admin():
         return "Unauthorized", 403
-    with sqlite3.connect(DB_NAME) as conn:
+    with db.connection('delete_user') as conn:
         c = conn.cursor()
         c.execute("DELETE FROM preferences WHERE user_id=?", (user_id,))
         c.execute("DELETE FROM users WHERE id=?", (user_id,))
         conn.commit()
+    preference_cache.invalidate(user_id)
     return redirect('/admin/users')
 
 @app.route('/admin/preferences')
 def admin_preferences():
     if not is_admin():
         return "Unauthorized", 403
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute("SELECT user_id, category, preference FROM preferences")
-        prefs = c.fetchall()
-    body = """
-    <h2>User Preferences</h2>
-    <table class="table table-bordered">
-        <thead><tr><th>User ID</th><th>Preference Key</th><th>Value</th></tr></thead>
-        <tbody>
-        {% for p in prefs %}
-        <tr>
-            <td>{{ p[0] }}</td>
-            <td>{{ p[1] }}</td>
-            <td>{{ p[2] }}</td>
-        </tr>
-        {% endfor %}
-        </tbody>
-    </table>
-    """
-    return render_with_layout("User Preferences", body, prefs=prefs)
-
-active_users = {}
-
-waiting_users = []  # Add this at the top of your file, near active_users
+    category = request.args.get('category', '')
+    sql, params = preferences_query(category, admin_cursor(2 if category else 3))
+    cursor_of = (lambda row: [row[2], row[0]]) if category else list
+    return admin_listing('admin/preferences.html', sql, params, cursor_of, category=category)
+
+@app.route('/admin/export/<table>.<fmt>')
+def admin_export(table, fmt):
+    if not is_admin():
+        return "Unauthorized", 403
+    if table not in EXPORT_COLUMNS or fmt not in FORMATS:
+        abort(404)
+    if table == 'users':
+        sql, params = users_query(request.args.get('prefix', ''), None)
+    else:
+        sql, params = preferences_query(request.args.get('category', ''), None)
+    lines, mimetype = FORMATS[fmt]
+    return Response(lines(EXPORT_COLUMNS[table], db.stream(sql, params, site='admin_export')), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'})
+
+PROFILE_TOP = 40
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    if not is_admin():
+        return "Unauthorized", 403
+    if request.method == 'POST':
+        action = request.form.get('action')
+        if action == 'start':
+            try:
+                rate = float(request.form.get('rate', profiler.rate))
+                interval = float(request.form.get('interval', profiler.interval))
+                if not 0 < rate <= 1 or interval <= 0:
+                    raise ValueError(rate)
+                profiler.start(request.form.get('mode'), rate=rate, interval=interval)
+            except ValueError:
+                abort(400)
+        elif action == 'stop':
+            profiler.stop()
+        elif action == 'reset':
+            profiler.reset()
+        return redirect('/admin/profile')
+    return render_template('admin/profile.html', profiler=profiler, top=PROFILE_TOP,
+                           functions=profiler.top_functions(PROFILE_TOP), stacks=profiler.top_stacks(PROFILE_TOP))
+
+@app.route('/admin/profile/<name>')
+def admin_profile_download(name):
+    if not is_admin():
+        return "Unauthorized", 403
+    top = request.args.get('top', type=int)
+    if name == 'stacks.txt':
+        body, mimetype = profiler.top_stacks(top), 'text/plain'
+    elif name == 'functions.txt':
+        body, mimetype = profiler.top_functions(top or PROFILE_TOP), 'text/plain'
+    elif name == 'profile.pstats':
+        body, mimetype = profiler.pstats_dump(), 'application/octet-stream'
+    else:
+        abort(404)
+    if body is None:
+        abort(404)
+    return Response(body, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename={name}'})
+
+# A waiting user wants MATCH_MIN_OVERLAP shared preferences at first and
+# settles for one fewer every MATCH_RELAX_AFTER seconds
+MATCH_MIN_OVERLAP = int(os.environ.get('CHAT_MATCH_MIN_OVERLAP', 1))
+MATCH_RELAX_AFTER = float(os.environ.get('CHAT_MATCH_RELAX_AFTER', 10))
+# 'greedy' matches each joiner on arrival; 'batch' queues joiners and pairs
+# the whole pool every MATCH_TICK seconds
+MATCH_MODE = os.environ.get('CHAT_MATCH_MODE', 'greedy')
+MATCH_TICK = float(os.environ.get('CHAT_MATCH_TICK', 0.5))
+if MATCHMAKER == 'sqlite':
+    matchmaker_db = Database(MATCHMAKER_DB_NAME)
+    matchmaker_db.on_timing = observe_db
+    matchmaker = SqliteMatchmaker(matchmaker_db, min_overlap=MATCH_MIN_OVERLAP, relax_after=MATCH_RELAX_AFTER)
+    rooms = SqliteRoomRegistry(matchmaker_db)
+else:
+    matchmaker = Matchmaker(min_overlap=MATCH_MIN_OVERLAP, relax_after=MATCH_RELAX_AFTER)
+    rooms = RoomRegistry()
+matchmaker.waits.observer = TIME_TO_MATCH.observe
+
+def shared_call(fn, *args):
+    # The sqlite matchmaker and room registry can wait seconds on another
+    # worker's write lock inside sqlite, so under gevent they run on the
+    # thread pool; the in-memory ones are dict operations and stay put
+    if MATCHMAKER == 'sqlite':
+        return run_blocking(fn, *args)
+    return fn(*args)
+
+metrics.gauge('chat_waiting_users', "Users waiting for a match, by shared preferences still required", ['tier'],
+              fn=lambda: {(tier,): n for tier, n in shared_call(matchmaker.stats)['tiers'].items()})
+metrics.gauge('chat_rooms', "Conversations in progress", fn=lambda: shared_call(len, rooms))
+if session_store is not None:
+    metrics.gauge('chat_sessions', "Server-side sessions", fn=lambda: len(session_store))
+    metrics.counter('chat_session_lookups_total', "Session store reads, by whether the session was found", ['result'],
+                    fn=lambda: {('hit',): session_store.hits, ('miss',): session_store.misses})
+    metrics.gauge('chat_session_hit_ratio', "Share of session store reads that found the session",
+                  fn=lambda: session_store.hits / ((session_store.hits + session_store.misses) or 1))
+    metrics.counter('chat_session_evictions_total', "Sessions dropped to stay under the size cap",
+                    fn=lambda: session_store.evictions)
+    metrics.counter('chat_session_expirations_total', "Expired sessions removed by the sweeper",
+                    fn=lambda: session_store.expired)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Per-sid token buckets: (events per second, burst)
+RATE_LIMITS = {
+    'message': RateLimiter(5, 10),
+    'typing': RateLimiter(10, 20),
+    'skip': RateLimiter(0.5, 3),
+}
+
+def instrumented(event):
+    histogram = HANDLER_SECONDS.labels(event)
+    def decorator(handler):
+        profiled = profiler.wrap(handler)
+        @functools.wraps(handler)
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return profiled(*args)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def rate_limited(event):
+    limiter = RATE_LIMITS[event]
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args):
+            if not limiter.allow(request.sid):
+                if event != 'typing':
+                    emit('rate-limited', {'event': event})
+                return
+            return handler(*args)
+        return wrapper
+    return decorator
+
+# At most one 'typing' broadcast per sender per window, and a 'stop-typing'
+# once they have been quiet for TYPING_STOP_AFTER seconds
+TYPING_WINDOW = float(os.environ.get('CHAT_TYPING_WINDOW', 1.0))
+TYPING_STOP_AFTER = 3.0
+typing_state = TypingCoalescer(window=TYPING_WINDOW, stop_after=TYPING_STOP_AFTER)
+def typing_sweeper():
+    while True:
+        socketio.sleep(TYPING_WINDOW / 2)
+        for sid, partner in typing_state.expired():
+            socketio.emit('stop-typing', {}, to=partner)
+
+# Recent messages per room, so a client whose connection drops can resume
+# its conversation within RESUME_GRACE seconds. CHAT_HISTORY_SIZE=0 turns
+# this off and a disconnect ends the conversation straight away. History is
+# per process: a client that resumes on another worker keeps its room but
+# gets no missed messages. The idlest rooms are evicted beyond HISTORY_ROOMS
+# rooms or HISTORY_BYTES of stored message text.
+HISTORY_SIZE = int(os.environ.get('CHAT_HISTORY_SIZE', 50))
+HISTORY_ROOMS = int(os.environ.get('CHAT_HISTORY_ROOMS', 10000))
+HISTORY_BYTES = int(os.environ.get('CHAT_HISTORY_BYTES', 64 * 1024 * 1024))
+RESUME_GRACE = float(os.environ.get('CHAT_RESUME_GRACE', 30))
+MAX_MESSAGE = int(os.environ.get('CHAT_MAX_MESSAGE', 2000))
+history = MessageHistory(size=HISTORY_SIZE, max_rooms=HISTORY_ROOMS, max_bytes=HISTORY_BYTES) if HISTORY_SIZE else None
+if history is not None:
+    metrics.gauge('chat_history_bytes', "Message text kept for resuming, in bytes", fn=lambda: history.bytes)
+    metrics.counter('chat_history_evictions_total', "Rooms whose history was dropped to stay under the caps",
+                    fn=lambda: history.evictions)
+reconnects = ReconnectGrace(grace=RESUME_GRACE)
+def reconnect_sweeper():
+    while True:
+        socketio.sleep(RESUME_GRACE / 2)
+        for sid in reconnects.expired():
+            end_pairing(sid)
+
+# A sid can disconnect after a matcher has taken it out of the pool but
+# before the pair is announced, possibly on another worker. Such sids are
+# looked at again once any pairing in flight has landed, and their partner
+# is told they left.
+DEPARTURE_GRACE = 5.0
+departures = ReconnectGrace(grace=DEPARTURE_GRACE)
+
+def departure_sweeper():
+    while True:
+        socketio.sleep(1)
+        for sid in departures.expired():
+            end_pairing(sid)
+
+def end_pairing(sid):
+    # Dissolve sid's conversation, if any, and tell the other side
+    pairing = shared_call(rooms.leave, sid)
+    if pairing is not None:
+        room_id, partner = pairing
+        typing_state.stop(partner)
+        reconnects.forget(partner)
+        if history is not None:
+            history.drop(room_id)
+        socketio.emit('partner-left', {}, to=partner)
+        log_event(logging.DEBUG, 'left', LOG_SAMPLE, sid=sid, room=room_id)
+    return pairing
+
+def announce_pair(sid, other_sid):
+    room_id = shared_call(rooms.pair, sid, other_sid)
+    MATCHES.inc()
+    log_event(logging.DEBUG, 'match', LOG_SAMPLE, sid=sid, partner=other_sid, room=room_id)
+    socketio.emit('partner-found', {'room': room_id}, to=sid)
+    socketio.emit('partner-found', {'room': room_id}, to=other_sid)
+
+def batch_matcher():
+    while True:
+        socketio.sleep(MATCH_TICK)
+        for entry, other in run_blocking(matchmaker.match_pending):
+            try:
+                announce_pair(entry[0], other[0])
+            except AlreadyPaired:
+                # One side re-joined and got paired after the tick took it
+                # out of the pool; the other goes back with its wait intact
+                for sid, uid, tag_ids, joined in (entry, other):
+                    if shared_call(rooms.room, sid) is None and sid not in departures:
+                        shared_call(matchmaker.enqueue, sid, uid, tag_ids, joined)
+
+# The handlers only need the user id, so read it from the session once per
+# connection; it also tells the batch matcher which sids are still here
+connected_users = {}  # sid -> user id, None for guests
+
+@socketio.on('connect')
+@instrumented('connect')
+def on_connect(auth=None):
+    connected_users[request.sid] = session.get('user_id')
 
 @socketio.on('join')
+@instrumented('join')
 def on_join():
-    uid = session.get('user_id')
-    print(f"[JOIN] {request.sid} (user_id={uid})")
-
-    user_prefs = get_user_preferences(uid) if uid else {}
-
-    # Try to match with someone already waiting
-    for other_sid, other_uid, other_prefs in waiting_users:
-        if other_sid == request.sid:
-            continue
-
-        # Calculate shared preferences
-        shared = 0
-        for cat in user_prefs:
-            if cat in other_prefs:
-                shared += len(set(user_prefs[cat]) & set(other_prefs[cat]))
-
-        # ✅ INSERT DEBUGGING LOGS HERE:
-        print(f"[MATCH CHECK] {request.sid} checking against {other_sid}")
-        print(f"Shared prefs: {shared}")
-        print(f"user_prefs: {user_prefs}")
-        print(f"other_prefs: {other_prefs}")
-
-        if shared > 0 or not uid or not other_uid:
-            # 👇 Add this logging:
-            print(f"[MATCH] {request.sid} matched with {other_sid}")
-            room_id = str(random.randint(10000, 99999))
-            join_room(room_id)
-            join_room(room_id, sid=other_sid)
-            emit('partner-found', {'room': room_id}, room=room_id)
-            waiting_users.remove((other_sid, other_uid, other_prefs))
+    uid = connected_users.get(request.sid)
+    log_event(logging.DEBUG, 'join', LOG_SAMPLE, sid=request.sid, user_id=uid)
+
+    end_pairing(request.sid)
+    tag_ids = get_user_tag_ids(uid) if uid else ()
+
+    if MATCH_MODE == 'batch':
+        shared_call(matchmaker.enqueue, request.sid, uid, tag_ids)
+        start_background_task_once(batch_matcher)
+    else:
+        # Try to match with someone already waiting, otherwise queue up
+        other_sid = shared_call(matchmaker.join, request.sid, uid, tag_ids)
+        if other_sid is not None:
+            announce_pair(request.sid, other_sid)
             return
 
     # No match found
-    waiting_users.append((request.sid, uid, user_prefs))
-    print(f"[WAITING] {request.sid} is waiting")
+    log_event(logging.DEBUG, 'waiting', LOG_SAMPLE, sid=request.sid)
     emit('partner-found', {'room': None})
 
+# Clients still send their room id, but routing only trusts the registry
+
 @socketio.on('message')
+@instrumented('message')
+@rate_limited('message')
 def on_message(data):
-    emit('message', {'message': data['message']}, room=data['room'])
+    pairing = shared_call(rooms.lookup, request.sid)
+    if pairing is None:
+        return
+    message = data.get('message')
+    if not isinstance(message, str) or len(message) > MAX_MESSAGE:
+        return
+    room_id, partner = pairing
+    typing_state.stop(request.sid)
+    seq = history.append(room_id, request.sid, message) if history is not None else None
+    MESSAGES.inc()
+    recent_messages.add()
+    emit('message', {'message': message, 'seq': seq}, to=partner)
 
 @socketio.on('typing')
-def on_typing(data):
-    emit('typing', {}, room=data['room'], include_self=False)
+@instrumented('typing')
+@rate_limited('typing')
+def on_typing(data=None):
+    partner = shared_call(rooms.partner, request.sid)
+    if partner is None:
+        return
+    start_background_task_once(typing_sweeper)
+    if typing_state.touch(request.sid, partner):
+        emit('typing', {}, to=partner)
 
 @socketio.on('skip')
-def on_skip(data):
-    leave_room(data['room'])
-    emit('partner-left', {}, room=data['room'])
+@instrumented('skip')
+@rate_limited('skip')
+def on_skip(data=None):
+    typing_state.stop(request.sid)
+    end_pairing(request.sid)
+    shared_call(matchmaker.remove, request.sid)
 
-    global waiting_users
-    waiting_users = [u for u in waiting_users if u[0] != request.sid]
-
-    print(f"[SKIP] {request.sid} skipped and left room {data['room']}")
+    log_event(logging.DEBUG, 'skip', LOG_SAMPLE, sid=request.sid)
 
     on_join()  # Try matching again
 
+@socketio.on('resume')
+@instrumented('resume')
+def on_resume(data):
+    # A reconnecting client presents its previous sid and room
+    old_sid = data.get('sid')
+    room_id = shared_call(rooms.room, old_sid) if old_sid else None
+    if history is None or room_id is None or room_id != data.get('room'):
+        return on_join()
+    # The client usually notices a dead connection before the server does,
+    # so the old sid may still be paired and not held yet; a held one has
+    # to be claimed before its grace runs out
+    if old_sid in reconnects and not reconnects.claim(old_sid):
+        return on_join()
+
+    shared_call(rooms.rebind, old_sid, request.sid)
+    history.rename(room_id, old_sid, request.sid)
+    partner = shared_call(rooms.partner, request.sid)
+    try:
+        seen = int(data.get('seen') or 0)
+    except (TypeError, ValueError):
+        seen = 0
+    missed = [{'seq': seq, 'message': message}
+              for seq, sender, message in history.since(room_id, seen)
+              if sender != request.sid]
+    log_event(logging.INFO, 'resume', old_sid=old_sid, sid=request.sid, missed=len(missed))
+    emit('resumed', {'room': room_id, 'messages': missed})
+    emit('partner-back', {}, to=partner)
+
 @socketio.on('disconnect')
+@instrumented('disconnect')
 def on_disconnect():
-    global waiting_users
-    waiting_users = [u for u in waiting_users if u[0] != request.sid]
-
-AUTH_TEMPLATE = '''
-<form method="POST">
-    <h2>Welcome to Chat Chat</h2>
-    <button name="action" value="login">Login</button>
-    <button name="action" value="register">Register</button>
-    <button name="action" value="skip">Continue as Guest</button>
-</form>
-'''
-
-LOGIN_TEMPLATE = '''
-<h2>Login</h2>
-<form method="POST">
-    <input name="username" placeholder="Username" required><br>
-    <input name="password" type="password" placeholder="Password" required><br>
-    <button type="submit">Login</button>
-</form>
-<br>
-<a href="/register">Don't have an account? Register →</a>
-<br>
-<p><small><strong>Login</strong> to save your preferences and connect with similar users. Or</small></p>
-<a href="/chat" style="color: #2a9df4;">Continue as Guest (no saved preferences)</a>
-'''
-
-REGISTER_TEMPLATE = '''
-<h2>Register</h2>
-<form method="POST">
-    <input name="username" placeholder="Username" required><br>
-    <input name="email" placeholder="Email"><br>
-    <input name="phone" placeholder="Phone"><br>
-    <input name="password" type="password" placeholder="Password" required><br>
-    <button type="submit">Register</button>
-</form>
-<br>
-<a href="/login">Already have an account? Login →</a>
-<br>
-<a href="/chat" style="color: #2a9df4;">Chat as Guest</a>
-'''
-
-PREFERENCES_TEMPLATE = '''
-<h2>Set Preferences</h2>
-<form method="POST">
-    <label>Category: Interest</label><br>
-    <input name="interest" value="gaming"> Gaming<br>
-    <input name="interest" value="movies"> Movies<br>
-    <input name="interest" value="books"> Books<br><br>
-    <label>Custom Preferences:</label><br>
-    <input name="custom" placeholder="e.g. anime, hiking, cooking, sci-fi"><br>
-    <small>Separate multiple values with commas. These help match you with others who like the same things!</small><br><br>
-    <button type="submit">Save</button>
-</form>
-<br><h3>Suggestions:</h3>
-<ul>
-{% set last_cat = None %}
-{% for cat, pref, count in suggestions %}
-    {% if cat != last_cat %}
-        {% if not loop.first %}</ul>{% endif %}
-        <li><strong>{{ cat }}</strong>:
-        <ul>
-        {% set last_cat = cat %}
-    {% endif %}
-    <li>{{ pref }} ({{ count }} users)</li>
-    {% if loop.last %}</ul>{% endif %}
-{% endfor %}
-</ul>
-'''
-
-CHAT_TEMPLATE = '''
-<!DOCTYPE html>
-<html>
-<head>
-<title>Chat Chat</title>
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<style>
-    * {
-        box-sizing: border-box;
-    }
-
-    body {
-        background: #0e0e0e;
-        color: white;
-        font-family: Arial, sans-serif;
-        text-align: center;
-        padding: 10px;
-        margin: 0;
-    }
-
-    #chat-box {
-        width: 100%;
-        max-width: 800px;
-        margin: 0 auto;
-        height: 50vh;
-        background: #1f1f1f;
-        padding: 10px;
-        overflow-y: auto;
-        border-radius: 8px;
-        border: 1px solid #444;
-    }
-
-    .message {
-        text-align: left;
-        margin: 5px 0;
-        word-wrap: break-word;
-    }
-
-    .you {
-        color: #81f781;
-    }
-
-    .stranger {
-        color: #81bef7;
-    }
-
-    .system {
-        color: #ffa500;
-        font-style: italic;
-    }
-
-    #typing {
-        font-style: italic;
-        color: #aaa;
-        margin-top: 5px;
-    }
-
-    .bar {
-        display: flex;
-        flex-direction: row;
-        align-items: center;
-        justify-content: center;
-        max-width: 800px;
-        margin: 10px auto;
-        flex-wrap: wrap;
-        gap: 10px;
-    }
-
-    input {
-        flex: 1;
-        min-width: 50px;
-        padding: 10px;
-        border-radius: 5px;
-        border: 1px solid #555;
-        background-color: #1a1a1a;
-        color: white;
-        font-size: 16px;
-    }
-
-    button {
-        padding: 10px 20px;
-        background: #2a9df4;
-        color: white;
-        border: none;
-        border-radius: 5px;
-        cursor: pointer;
-        font-size: 16px;
-    }
-
-    button:hover {
-        background: #007acc;
-    }
-
-    @media (max-width: 600px) {
-        #chat-box {
-            height: 40vh;
-        }
-
-        .bar {
-            flex-direction: column;
-            align-items: stretch;
-        }
-
-        input {
-            width: 100%;
-        }
-
-        button {
-            width: 100%;
-        }
-    }
-</style>
-</head>
-<body>
-<h2>Welcome to Chat Chat</h2>
-{% with messages = get_flashed_messages() %}
-  {% if messages %}
-    <div style="color: #00ff99; font-weight: bold;">
-        {{ messages[0] }}
-    </div>
-  {% endif %}
-{% endwith %}
-{% if not user_id %}
-    <div style="margin-bottom: 15px;">
-        <a href="/login">
-            <button style="margin-right: 10px;">Login</button>
-        </a>
-        <a href="/register">
-            <button>Register</button>
-        </a>
-    </div>
-{% else %}
-    <p style="color: #aaa;">You are logged in.</p>
-{% endif %}
-<div id="chat-box"></div>
-<div id="typing"></div>
-<div class="bar">
-    <button id="skip">Skip</button>
-</div>
-
-<div class="bar chat-controls" style="display:none;">
-    <input id="input" placeholder="Type a message...">
-    <button id="send">Send</button>
-</div>
-
-<script src="https://cdn.socket.io/4.0.0/socket.io.min.js"></script>
-<script>
-    const socket = io();
-    let room = '';
-    const input = document.getElementById('input');
-    const sendBtn = document.getElementById('send');
-
-    window.onload = () => {
-        socket.emit('join');
-    };
-    socket.on('partner-found', data => {
-        console.log("Partner-found data:", data);
-        room = data && data.room;
-
-        const controls = document.querySelector('.chat-controls');
-
-        if (room) {
-            append("System: Connected to a stranger", 'system');
-            controls.style.display = 'flex';
-            input.disabled = false;
-            sendBtn.disabled = false;
-        } else {
-            append("System: Waiting for a match...", 'system');
-            controls.style.display = 'none';
-            input.disabled = true;
-            sendBtn.disabled = true;
-        }
-    });
-
-    socket.on('message', data => {
-        append("Stranger: " + data.message, 'stranger');
-    });
-
-    socket.on('typing', () => {
-        document.getElementById('typing').innerText = "Stranger is typing...";
-        setTimeout(() => document.getElementById('typing').innerText = "", 2000);
-    });
-
-    document.getElementById('send').onclick = sendMsg;
-    document.getElementById('skip').onclick = () => {
-        socket.emit('skip', { room });
-        document.getElementById('chat-box').innerHTML = '';
-    };
-
-    input.addEventListener('keypress', e => {
-        if (e.key === 'Enter') sendMsg();
-        else socket.emit('typing', { room });
-    });
-
-    function sendMsg() {
-        const val = input.value;
-        if (val.trim() && room) {
-            append("You: " + val, 'you');
-            socket.emit('message', { message: val, room });
-            input.value = '';
-        }
-    }
-
-    function append(text, cls) {
-        const div = document.createElement('div');
-        div.innerText = text;
-        div.className = 'message ' + cls;
-        const box = document.getElementById('chat-box');
-        box.appendChild(div);
-        box.scrollTop = box.scrollHeight;
-    }
-</script>
-</body>
-</html>
-'''
-if __name__ == '__main__':
-    app.run(debug=True)
+    waiting = shared_call(matchmaker.remove, request.sid)
+    typing_state.stop(request.sid)
+    if history is not None and shared_call(rooms.room, request.sid) is not None:
+        # Keep the seat warm for a while in case this is a network blip
+        reconnects.hold(request.sid)
+        start_background_task_once(reconnect_sweeper)
+    elif end_pairing(request.sid) is None and not waiting:
+        departures.hold(request.sid)
+        start_background_task_once(departure_sweeper)
+    for limiter in RATE_LIMITS.values():
+        limiter.forget(request.sid)
+    connected_users.pop(request.sid, None)
+
+for endpoint, view in list(app.view_functions.items()):
+    if endpoint != 'static':
+        app.view_functions[endpoint] = profiler.wrap(view)
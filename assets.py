@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+ONE_YEAR = 365 * 24 * 3600
+
+
+class Asset:
+    def __init__(self, data, mimetype, digest):
+        self.mimetype = mimetype
+        self.digest = digest
+        # Precompress once at startup; only keep variants that actually help
+        self.variants = {'identity': data}
+        for encoding, compress in (('br', brotli and brotli.compress), ('gzip', lambda d: gzip.compress(d, 9, mtime=0))):
+            if compress:
+                packed = compress(data)
+                if len(packed) < len(data):
+                    self.variants[encoding] = packed
+
+
+class AssetPipeline:
+    """Serve static/ under content-hashed URLs that can be cached forever.
+
+    Templates call asset_url('js/chat.js') and get '/assets/js/chat.<hash>.js'.
+    A changed file gets a new hash and therefore a new URL, so responses
+    carry a one-year immutable Cache-Control, an ETag for conditional GETs,
+    and a gzip or brotli body when the client accepts one.
+    """
+
+    def __init__(self, directory, url_prefix='/assets'):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.urls = {}     # logical name -> hashed URL
+        self.assets = {}   # hashed name -> Asset
+        self.load()
+
+    def load(self):
+        urls, assets = {}, {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                stem, ext = os.path.splitext(name)
+                hashed = f"{stem}.{digest}{ext}"
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                assets[hashed] = Asset(data, mimetype, digest)
+                urls[name] = f"{self.url_prefix}/{hashed}"
+        self.urls, self.assets = urls, assets
+
+    def url(self, name):
+        return self.urls[name]
+
+    def serve(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+        headers = {
+            'Cache-Control': f'public, max-age={ONE_YEAR}, immutable',
+            'ETag': f'"{asset.digest}"',
+            'Vary': 'Accept-Encoding',
+        }
+        if request.if_none_match.contains_weak(asset.digest):
+            return Response(status=304, headers=headers)
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in asset.variants and accepted[encoding]:
+                headers['Content-Encoding'] = encoding
+                return Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
+        return Response(asset.variants['identity'], mimetype=asset.mimetype, headers=headers)
+
+    def init_app(self, app):
+        app.add_url_rule(f"{self.url_prefix}/<path:filename>", 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
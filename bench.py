@@ -0,0 +1,390 @@
+"""Micro-benchmarks for the hot paths in app.py.
+
+Run with `python bench.py [name ...]`; with no names every benchmark runs.
+Each benchmark builds its own throwaway database, and the one app migrates
+on import is a scratch file too, so the real db.sqlite is never touched.
+"""
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from flask import render_template, render_template_string
+
+SCRATCH = tempfile.TemporaryDirectory()
+os.environ['CHAT_DB'] = os.path.join(SCRATCH.name, 'db.sqlite')
+
+import app
+from db import Database
+from matchmaker import Matchmaker, SqliteMatchmaker, overlap, preference_tags
+from passwords import PasswordHasher
+
+CATEGORIES = ['interest', 'custom']
+VOCAB = [f"tag{i}" for i in range(500)]
+TAG_IDS = {}  # stands in for the tags table: (category, preference) -> tags.id
+
+
+def tag_ids(prefs):
+    # A user's sorted tags.id values, as app.get_user_tag_ids() returns them;
+    # int(str()) gives each user its own int objects, as sqlite rows do
+    return tuple(sorted(int(str(TAG_IDS.setdefault(tag, len(TAG_IDS) + 1))) for tag in preference_tags(prefs)))
+
+
+def timed(fn, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name, seconds):
+    print(f"  {name:<32} {seconds * 1000:10.2f} ms")
+
+
+def report_rate(name, fn, n):
+    seconds = timed(lambda: [fn() for _ in range(n)], repeat=3)
+    print(f"  {name:<32} {n / seconds:10.0f} /s")
+
+
+def temp_db():
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    app.DB_NAME = path
+    app.db = Database(path)
+    app.init_db()
+    return path
+
+
+def seed_preferences(path, users, prefs_per_user=6, seed=0):
+    rng = random.Random(seed)
+    rows = ((uid, rng.choice(CATEGORIES), tag)
+            for uid in range(1, users + 1)
+            for tag in rng.sample(VOCAB, prefs_per_user))
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT INTO preferences (user_id, category, preference) VALUES (?, ?, ?)", rows)
+
+
+MATCH_LIMIT = 50
+
+
+def match_query(tags, exclude_id=None, limit=MATCH_LIMIT):
+    # Score every candidate in one grouped query instead of one query per
+    # preference. CROSS JOIN pins the tag list as the outer loop so each tag
+    # is a lookup on the (category, preference, user_id) index
+    values = ", ".join(["(?, ?)"] * len(tags))
+    sql = f"""WITH wanted(category, preference) AS (VALUES {values})
+             SELECT p.user_id, COUNT(*) AS score FROM wanted
+             CROSS JOIN preferences p
+                 ON p.category = wanted.category AND p.preference = wanted.preference
+             WHERE p.user_id IS NOT ?
+             GROUP BY p.user_id ORDER BY score DESC, p.user_id LIMIT ?"""
+    return sql, [v for tag in tags for v in tag] + [exclude_id, limit]
+
+
+def match_user_by_preferences(user_prefs, exclude_id=None, limit=MATCH_LIMIT):
+    # Ranks every user in the database, online or not; matching goes through
+    # matchmaker.py, so this only measures the query
+    tags = list({(cat, pref) for cat, prefs in user_prefs.items() for pref in prefs})
+    if not tags:
+        return []
+    sql, params = match_query(tags, exclude_id, limit)
+    with app.db.connection('match_user_by_preferences') as conn:
+        return [uid for uid, _ in conn.execute(sql, params)]
+
+
+def legacy_match_user_by_preferences(user_prefs, exclude_id=None):
+    # The original one-query-per-preference loop, kept for comparison
+    with sqlite3.connect(app.DB_NAME) as conn:
+        c = conn.cursor()
+        scores = {}
+        for category, prefs in user_prefs.items():
+            for pref in prefs:
+                c.execute("SELECT user_id FROM preferences WHERE category=? AND preference=?", (category, pref))
+                for (uid,) in c.fetchall():
+                    if uid == exclude_id:
+                        continue
+                    scores[uid] = scores.get(uid, 0) + 1
+        return sorted(scores, key=scores.get, reverse=True)
+
+
+def bench_match_user_by_preferences(users=100_000, tags=30):
+    print(f"match_user_by_preferences: {users} users, {tags} tags")
+    path = temp_db()
+    try:
+        seed_preferences(path, users)
+        rng = random.Random(1)
+        user_prefs = {}
+        for tag in rng.sample(VOCAB, tags):
+            user_prefs.setdefault(rng.choice(CATEGORIES), []).append(tag)
+        report("per-preference loop", timed(legacy_match_user_by_preferences, user_prefs, 1))
+        report("single grouped query", timed(match_user_by_preferences, user_prefs, 1))
+    finally:
+        app.db.close()
+        os.remove(path)
+
+
+def bench_templates(n=2000):
+    print(f"templates: {n} renders each")
+    def source(name):
+        with open(os.path.join(app.app.root_path, 'templates', name)) as f:
+            return f.read()
+    chat, auth = source('chat.html'), source('auth.html')
+    with app.app.test_request_context('/chat'):
+        # render_template_string re-parses and re-compiles on every call
+        report_rate("chat: render_template_string", lambda: render_template_string(chat, user_id=None), n)
+        report_rate("chat: precompiled", lambda: render_template('chat.html', user_id=None), n)
+        report_rate("auth: render_template_string", lambda: render_template_string(auth, extra_class='shake'), n)
+        report_rate("auth: prebuilt bytes", lambda: app.static_page('auth.html', extra_class='shake'), n)
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['age_verified'] = True
+    report_rate("GET /auth requests", lambda: client.get('/auth'), n)
+
+
+def waiting_pool(users, seed=0):
+    rng = random.Random(seed)
+    pool = []
+    for i in range(users):
+        uid = i + 1 if rng.random() < 0.7 else None
+        prefs = {}
+        for tag in rng.sample(VOCAB, 5) if uid else ():
+            prefs.setdefault(rng.choice(CATEGORIES), []).append(tag)
+        pool.append((f"sid{i}", uid, tag_ids(prefs)))
+    return pool
+
+
+def pairing_quality(pool, pairs):
+    tag_ids = {sid: ids for sid, _, ids in pool}
+    shared = [overlap(tag_ids[a], tag_ids[b]) for a, b in pairs]
+    return f"{len(pairs):6} pairs, {sum(shared) / max(len(shared), 1):.2f} shared tags/pair"
+
+
+def bench_batch_matching(sizes=(1000, 10_000, 50_000)):
+    print("matching a burst of joins: per-event greedy vs one batch tick")
+    for users in sizes:
+        pool = waiting_pool(users)
+        # Everyone arrives within the same second, as after a marketing push
+        greedy = Matchmaker()
+        start = time.perf_counter()
+        pairs = []
+        for i, (sid, uid, ids) in enumerate(pool):
+            other = greedy.join(sid, uid, ids, now=i / users)
+            if other is not None:
+                pairs.append((sid, other))
+        report(f"{users} greedy joins", time.perf_counter() - start)
+        print(f"  {'':<32} {pairing_quality(pool, pairs)}")
+
+        batch = Matchmaker()
+        for i, (sid, uid, ids) in enumerate(pool):
+            batch.enqueue(sid, uid, ids, now=i / users)
+        start = time.perf_counter()
+        pairs = [(entry[0], other[0]) for entry, other in batch.match_pending(now=1.0)]
+        report(f"{users} batch tick", time.perf_counter() - start)
+        print(f"  {'':<32} {pairing_quality(pool, pairs)}")
+
+
+def bench_joins(sizes=(1000, 10_000, 50_000), joins=1000, min_overlap=5):
+    print(f"greedy join cost as the pool grows: {joins} joins, min_overlap={min_overlap}")
+    # The preferences form always posts the three interest tags, so every
+    # registered user shares them with everyone else waiting; a custom tag
+    # each keeps them from matching, which is the worst case for a join
+    common = {'interest': ['gaming', 'movies', 'books']}
+    def user(i):
+        return tag_ids(dict(common, custom=[f"joins{i}"]))
+    for users in sizes:
+        pool = [user(i) for i in range(users + joins)]
+        makers = [("Matchmaker", lambda: Matchmaker(min_overlap=min_overlap))]
+        if users <= 10_000:
+            # every enqueue is its own transaction, so keep the sqlite pool smaller
+            makers.append(("SqliteMatchmaker", lambda: SqliteMatchmaker(
+                Database(tempfile.mktemp(suffix='.sqlite')), min_overlap=min_overlap)))
+        for name, make in makers:
+            matchmaker = make()
+            for i in range(users):
+                matchmaker.enqueue(f"sid{i}", i + 1, pool[i], now=0)
+            start = time.perf_counter()
+            for i in range(users, users + joins):
+                matchmaker.join(f"sid{i}", i + 1, pool[i], now=0)
+            seconds = time.perf_counter() - start
+            print(f"  {f'{name}, {users} waiting':<32} {seconds / joins * 1e6:10.1f} us/join")
+            if isinstance(matchmaker, SqliteMatchmaker):
+                matchmaker.db.close()
+                os.remove(matchmaker.db.path)
+
+
+def dict_overlap(a, b):
+    # The original on_join comparison over dicts of lists of strings
+    return sum(len(set(a[cat]) & set(b[cat])) for cat in a if cat in b)
+
+
+def retained_bytes(build):
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def bench_overlap(users=10_000, comparisons=200_000, custom_tags=200_000):
+    print(f"preference overlap: {users} waiting users, {comparisons} comparisons")
+    rng = random.Random(0)
+    # A long-lived database holds plenty of free-text custom tags made before
+    # these users' ones, so their ids are large
+    for i in range(custom_tags):
+        TAG_IDS.setdefault(('custom', f"filler{i}"), len(TAG_IDS) + 1)
+    prefs = []
+    for _ in range(users):
+        user = {}
+        for tag in rng.sample(VOCAB, 6):
+            user.setdefault(rng.choice(CATEGORIES), []).append(tag)
+        prefs.append(user)
+    pairs = [(rng.randrange(users), rng.randrange(users)) for _ in range(comparisons)]
+    # Every waiting entry gets its own copy of the strings, as when they are
+    # read back from sqlite rows
+    def rows():
+        return [{cat: [v.encode().decode() for v in values] for cat, values in p.items()} for p in prefs]
+    for name, build, shared in (
+            ("dict of lists", rows, dict_overlap),
+            ("frozenset of tuples", lambda: [preference_tags(p) for p in rows()], lambda a, b: len(a & b)),
+            ("tags.id tuple, set intersection", lambda: [tag_ids(p) for p in rows()],
+             lambda a, b: len(set(a).intersection(b))),
+            ("tags.id tuple, sorted merge", lambda: [tag_ids(p) for p in rows()], overlap)):
+        print(f"  {name:<32} {retained_bytes(build) / users:10.0f} B/user")
+        values = build()
+        seconds = timed(lambda: [shared(values[i], values[j]) for i, j in pairs], repeat=3)
+        print(f"  {'':<32} {comparisons / seconds:10.0f} comparisons/s")
+
+
+# Hot queries that must be answered from an index, never a full table scan.
+# They are the statements app.py runs, so a change there is checked here
+HOT_QUERIES = [
+    ("login", app.LOGIN_QUERY, ('someone',)),
+    ("get_user_preferences", app.USER_PREFERENCES_QUERY, (1,)),
+    ("get_user_tag_ids", app.USER_TAG_IDS_QUERY, (1,)),
+    ("preferences delete", "DELETE FROM preferences WHERE user_id=?", (1,)),
+    ("preference suggestions", app.SUGGESTIONS_QUERY, (app.SUGGESTION_LIMIT,)),
+    ("match", *match_query([('interest', 'tag1'), ('music', 'tag2')], 1)),
+    ("admin users page", app.users_query('us', ['user5', 5])[0] + " LIMIT 100", app.users_query('us', ['user5', 5])[1]),
+    ("admin preferences page", app.preferences_query('', [5, 'interest', 'tag1'])[0] + " LIMIT 100", [5, 'interest', 'tag1']),
+    ("admin category page", app.preferences_query('interest', ['tag1', 5])[0] + " LIMIT 100", ['interest', 'tag1', 5]),
+]
+
+
+def is_table_scan(step, sql):
+    # Walking a CTE or a VALUES list is fine; walking a table without an index is not
+    if not step.startswith('SCAN ') or 'INDEX' in step or step.endswith('CONSTANT ROWS'):
+        return False
+    return step.split()[1] not in re.findall(r'\bWITH\s+(\w+)', sql)
+
+
+def check_query_plans():
+    print("query plans")
+    path = temp_db()
+    failed = False
+    try:
+        seed_preferences(path, 1000)
+        with app.db.connection() as conn:
+            conn.execute("ANALYZE")
+            for name, sql, params in HOT_QUERIES:
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+                uses_index = not any(is_table_scan(step, sql) for step in plan)
+                failed = failed or not uses_index
+                print(f"  {name:<32} {'ok  ' if uses_index else 'SCAN'} {'; '.join(plan)}")
+    finally:
+        app.db.close()
+        os.remove(path)
+    if failed:
+        sys.exit("hot query without an index")
+
+
+def bench_profiler(n=2000, calls=1_000_000):
+    print(f"profiler: {n} GET /auth requests each")
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['age_verified'] = True
+    profiler = app.profiler
+    def requests():
+        for _ in range(n):
+            client.get('/auth')
+    request = timed(requests) / n
+    # Request timings are too noisy to show a sub-percent difference, so
+    # time the switched-off wrapper on its own and compare it to a request
+    noop = lambda: None
+    wrapped = profiler.wrap(noop)
+    bare = timed(lambda: [noop() for _ in range(calls)]) / calls
+    off = timed(lambda: [wrapped() for _ in range(calls)]) / calls - bare
+    print(f"  {'request':<32} {request * 1e6:10.1f} us")
+    print(f"  {'wrapper when off':<32} {off * 1e9:10.1f} ns {off / request * 100:6.3f}%")
+    for mode, rate in (('cprofile', 0.01), ('cprofile', 1.0), ('sample', None)):
+        profiler.reset()
+        profiler.start(mode, rate=rate)
+        try:
+            seconds = timed(requests) / n
+        finally:
+            profiler.stop()
+        name = f"{mode} rate={rate}" if rate else mode
+        print(f"  {name:<32} {seconds * 1e6:10.1f} us {(seconds / request - 1) * 100:+6.1f}%")
+    profiler.reset()
+
+
+def bench_registrations(users=48, threads=8, method='pbkdf2:sha256:100000'):
+    print(f"registrations: {users} from {threads} threads, {method}")
+    path = temp_db()
+    hasher = app.passwords
+    counter = iter(range(10**9))
+    def register():
+        client = app.app.test_client()
+        for _ in range(users // threads):
+            client.post('/register', data={'username': f"user{next(counter)}", 'password': 'hunter22'})
+    def burst():
+        workers = [threading.Thread(target=register) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        # a cheap request made during the burst stands in for a heartbeat
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess['age_verified'] = True
+        stalls = []
+        while any(worker.is_alive() for worker in workers):
+            start = time.perf_counter()
+            client.get('/auth')
+            stalls.append(time.perf_counter() - start)
+            time.sleep(0.01)
+        for worker in workers:
+            worker.join()
+        return max(stalls, default=0)
+    try:
+        for workers in sorted({1, os.cpu_count() or 1, threads}):
+            app.passwords = PasswordHasher(method, workers)
+            start = time.perf_counter()
+            stall = burst()
+            seconds = time.perf_counter() - start
+            print(f"  {f'{workers} hashing at once':<32} {users / seconds:10.1f} /s  slowest GET /auth {stall * 1000:.1f} ms")
+    finally:
+        app.passwords = hasher
+        app.db.close()
+        os.remove(path)
+
+
+BENCHMARKS = {
+    'batch': bench_batch_matching,
+    'joins': bench_joins,
+    'match': bench_match_user_by_preferences,
+    'overlap': bench_overlap,
+    'plans': check_query_plans,
+    'profiler': bench_profiler,
+    'registrations': bench_registrations,
+    'templates': bench_templates,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
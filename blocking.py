@@ -0,0 +1,31 @@
+import sys
+
+
+def _offloader():
+    # Under a cooperative server (gevent/eventlet) a blocking C call such as
+    # a sqlite query stalls every connection on the worker, so hand it to the
+    # hub's native thread pool. Plain threads need no help.
+    if 'gevent' in sys.modules:
+        from gevent import get_hub, monkey
+        if monkey.is_module_patched('threading'):
+            return lambda fn, *args, **kwargs: get_hub().threadpool.apply(fn, args, kwargs)
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher, tpool
+        if patcher.is_monkey_patched('thread'):
+            return tpool.execute
+    return None
+
+
+_offload = None
+_resolved = False
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) without blocking the event loop."""
+    global _offload, _resolved
+    if not _resolved:
+        _offload = _offloader()
+        _resolved = True
+    if _offload is None:
+        return fn(*args, **kwargs)
+    return _offload(fn, *args, **kwargs)
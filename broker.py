@@ -0,0 +1,62 @@
+import queue
+import threading
+
+import socketio
+
+LOCAL_URL = 'memory://'
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """In-process stand-in for a Redis/AMQP message queue.
+
+    Every manager created on the same channel in this process sees every
+    other manager's emits and room changes, exactly as separate workers would
+    through Redis. Useful for running several SocketIO servers side by side
+    in tests, or a single worker with the same code path as production.
+    """
+    name = 'local'
+
+    _hub_lock = threading.Lock()
+    _hub = {}  # channel -> list of subscriber queues
+
+    def __init__(self, channel='flask-socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self._inbox = queue.Queue()
+        if not write_only:
+            with self._hub_lock:
+                self._hub.setdefault(channel, []).append(self._inbox)
+
+    def _publish(self, data):
+        # Serialise like a real broker would, so no state is shared by reference
+        message = self.json.dumps(data)
+        with self._hub_lock:
+            subscribers = list(self._hub.get(self.channel, ()))
+        for inbox in subscribers:
+            inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+    def close(self):
+        with self._hub_lock:
+            subscribers = self._hub.get(self.channel, [])
+            if self._inbox in subscribers:
+                subscribers.remove(self._inbox)
+
+
+def socketio_options(url, channel=None):
+    """SocketIO() keyword arguments for the message queue at `url`.
+
+    None keeps everything in this process, memory:// uses the local stand-in,
+    and anything else (redis://, amqp://, zmq+tcp://, ...) is handed to
+    Flask-SocketIO's own queue backends.
+    """
+    if not url:
+        return {}
+    if url == LOCAL_URL:
+        return {'client_manager': LocalPubSubManager(channel=channel or 'flask-socketio')}
+    options = {'message_queue': url}
+    if channel:
+        options['channel'] = channel
+    return options
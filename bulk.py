@@ -0,0 +1,215 @@
+"""Bulk import and export of users and preferences.
+
+    python bulk.py export users users.ndjson
+    python bulk.py export preferences - --format csv > preferences.csv
+    python bulk.py import preferences preferences.csv
+
+The format comes from the file extension unless --format is given; `-` is
+stdin or stdout. Exports stream straight from a cursor, so memory use stays
+flat. Imports run in one transaction: the table's indexes and triggers are
+dropped, rows go in with executemany() a chunk at a time, and everything is
+rebuilt at the end, so a failed import leaves the database as it was. The
+import holds sqlite's write lock throughout; stop the server first, or expect
+its writes to time out.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from counters import reconcile_counters
+from db import Database
+from export import EXPORT_COLUMNS, FORMATS
+from migrations import migrate
+
+CHUNK = 50_000
+
+# Unlike the admin panel exports these carry password hashes, so moving
+# accounts between databases keeps them able to log in
+COLUMNS = dict(EXPORT_COLUMNS, users=EXPORT_COLUMNS['users'] + ('password',))
+ORDER = {
+    'users': 'id',
+    'preferences': 'user_id, category, preference',
+}
+
+# Run after an import with the triggers off, as migrations 3 and 4 did;
+# the dashboard counters are reconciled after every import
+REBUILD = {
+    'preferences': (
+        """INSERT OR IGNORE INTO tags (category, preference)
+           SELECT DISTINCT category, preference FROM preferences
+           WHERE category IS NOT NULL AND preference IS NOT NULL""",
+        """UPDATE tags SET user_count = (
+               SELECT COUNT(*) FROM preferences p
+               WHERE p.category = tags.category AND p.preference = tags.preference)""",
+    ),
+}
+
+# Run only if a unique index will not build. Preferences are sets, so
+# repeats are dropped; a repeated username is an error, since there is no
+# telling which account should win
+DEDUPE = {
+    'preferences': """DELETE FROM preferences WHERE rowid NOT IN (
+        SELECT MIN(rowid) FROM preferences GROUP BY user_id, category, preference)""",
+}
+
+
+class Progress:
+    def __init__(self, label, out=sys.stderr):
+        self.label = label
+        self.out = out
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    def add(self, rows):
+        self.rows += rows
+        self.show('\r')
+
+    def show(self, end):
+        seconds = time.perf_counter() - self.start
+        rate = self.rows / seconds if seconds else 0
+        self.out.write(f"{self.label}: {self.rows:,} rows in {seconds:.1f}s ({rate:,.0f}/s){end}")
+        self.out.flush()
+
+    def done(self):
+        self.show('\n')
+
+
+def check_columns(names, columns):
+    unknown = set(names) - set(columns)
+    if unknown:
+        raise ValueError(f"unknown column(s): {', '.join(sorted(unknown))}")
+
+
+def csv_rows(lines, columns):
+    reader = csv.reader(lines)
+    header = next(reader, [])
+    check_columns(header, columns)
+    positions = [header.index(column) if column in header else None for column in columns]
+    for record in reader:
+        if len(record) != len(header):
+            if not record:
+                continue
+            raise ValueError(f"line {reader.line_num}: {len(record)} fields, the header has {len(header)}")
+        # csv writes None as an empty field; read it back the same way
+        yield tuple(record[i] or None if i is not None else None for i in positions)
+
+
+def ndjson_rows(lines, columns):
+    allowed = frozenset(columns)
+    for line in lines:
+        if line.strip():
+            record = json.loads(line)
+            if not record.keys() <= allowed:
+                check_columns(record, columns)
+            yield tuple(record.get(column) for column in columns)
+
+
+READERS = {
+    'csv': csv_rows,
+    'ndjson': ndjson_rows,
+}
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def counted(rows, progress, every=CHUNK):
+    n = 0
+    for row in rows:
+        yield row
+        n += 1
+        if n == every:
+            progress.add(n)
+            n = 0
+    progress.add(n)
+
+
+def export_table(db, table, fmt, out, progress):
+    columns = COLUMNS[table]
+    lines, _ = FORMATS[fmt]
+    rows = db.stream(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {ORDER[table]}", site='bulk_export')
+    out.writelines(lines(columns, counted(rows, progress)))
+    progress.done()
+
+
+def import_table(db, table, fmt, lines, progress, chunk=CHUNK):
+    columns = COLUMNS[table]
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    with db.connection('bulk_import') as conn:
+        conn.execute("BEGIN")
+        deferred = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master"
+            " WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL", (table,)).fetchall()
+        for kind, name, _ in deferred:
+            conn.execute(f"DROP {kind.upper()} {name}")
+        for rows in chunks(READERS[fmt](lines, columns), chunk):
+            conn.executemany(insert, rows)
+            progress.add(len(rows))
+        progress.done()
+        # indexes before triggers, and before the rebuild queries that use them
+        deduped = table not in DEDUPE
+        for kind, _, sql in sorted(deferred, key=lambda item: item[0] != 'index'):
+            try:
+                conn.execute(sql)
+            except sqlite3.IntegrityError:
+                if deduped:
+                    raise
+                conn.execute(DEDUPE[table])
+                deduped = True
+                conn.execute(sql)
+        for sql in REBUILD.get(table, ()):
+            conn.execute(sql)
+        reconcile_counters(conn)
+
+
+def open_file(path, mode):
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export users and preferences.")
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('table', choices=sorted(COLUMNS))
+    parser.add_argument('path', help="file to read or write, or - for stdin/stdout")
+    parser.add_argument('--format', choices=sorted(FORMATS), help="default: from the file extension")
+    parser.add_argument('--db', default=os.environ.get('CHAT_DB', 'db.sqlite'))
+    parser.add_argument('--chunk', type=int, default=CHUNK, help="rows per executemany() call")
+    args = parser.parse_args()
+
+    fmt = args.format or os.path.splitext(args.path)[1].lstrip('.')
+    if fmt not in FORMATS:
+        parser.error("can't tell the format from the file name; pass --format")
+    db = Database(args.db)
+    with db.connection() as conn:
+        migrate(conn)
+    progress = Progress(f"{args.action} {args.table}")
+    try:
+        if args.action == 'export':
+            with open_file(args.path, 'w') as out:
+                export_table(db, args.table, fmt, out, progress)
+        else:
+            with open_file(args.path, 'r') as lines:
+                import_table(db, args.table, fmt, lines, progress, args.chunk)
+    except (ValueError, sqlite3.IntegrityError) as exc:
+        sys.exit(f"\nimport failed, nothing was imported: {exc}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded in-process cache; the least recently used entry goes first.
+
+    The memory budget is `max_entries` values, so size it for the values you
+    keep: a user's preference tag ids are a few dozen bytes. A
+    budget of 0 disables caching and every get() is a miss.
+
+    With a `ttl`, entries older than that many seconds are misses, which
+    bounds how stale a value can be when another process changed it and
+    invalidate() only reached that process's cache.
+    """
+
+    def __init__(self, max_entries=100_000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires, value)
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, now=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] is not None and entry[0] <= (time.monotonic() if now is None else now):
+                del self._data[key]
+                self.misses += 1
+                self.expired += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, now=None):
+        if not self.max_entries:
+            return
+        expires = (time.monotonic() if now is None else now) + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'expired': self.expired}
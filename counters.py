@@ -0,0 +1,42 @@
+# Row counts kept in the counters table by the triggers from migration 6, so
+# the admin dashboard reads a couple of rows by primary key instead of
+# scanning users and preferences on every view. Anything that bypasses the
+# triggers (bulk.py drops them during an import) should reconcile afterwards.
+COUNTS = {
+    'users': "SELECT COUNT(*) FROM users",
+    'preference_users': "SELECT COUNT(DISTINCT user_id) FROM preferences",
+}
+
+
+def read_counters(conn):
+    return dict(conn.execute("SELECT name, value FROM counters"))
+
+
+def counter_drift(conn):
+    """Recount from the tables; returns {name: (stored, actual)} for each miss.
+
+    Run it inside one transaction, a read one will do, so the counters and
+    the counts come from the same snapshot.
+    """
+    stored = read_counters(conn)
+    drift = {}
+    for name, sql in COUNTS.items():
+        actual = conn.execute(sql).fetchone()[0]
+        if stored.get(name) != actual:
+            drift[name] = (stored.get(name), actual)
+    return drift
+
+
+def apply_counter_drift(conn, drift):
+    # Add the difference rather than store the count: whatever the triggers
+    # added since the snapshot was taken is kept
+    conn.executemany("""INSERT INTO counters (name, value) VALUES (?, ?)
+                        ON CONFLICT (name) DO UPDATE SET value = value + excluded.value""",
+                     [(name, actual - (stored or 0)) for name, (stored, actual) in drift.items()])
+
+
+def reconcile_counters(conn):
+    """counter_drift() and apply_counter_drift() for a caller already holding the write lock."""
+    drift = counter_drift(conn)
+    apply_counter_drift(conn, drift)
+    return drift
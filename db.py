@@ -0,0 +1,101 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Applied to every pooled connection. journal_mode=WAL lets readers run while
+# a writer holds the lock; busy_timeout makes overlapping writers wait instead
+# of failing with "database is locked".
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # KiB, i.e. 16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",    # 256 MB
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+POOL_SIZE = 8
+STATEMENT_CACHE = 256
+STREAM_CHUNK = 500
+
+
+class Database:
+    """Per-worker pool of tuned sqlite3 connections.
+
+    Connections are checked out for the length of a `with db.connection()`
+    block, so the prepared-statement cache sqlite3 keeps on each connection
+    survives across requests. The pool is dropped after a fork so gunicorn
+    workers never share a handle with the master.
+
+    Set `on_timing` to a callable(site, seconds) to time every block; `site`
+    is whatever the caller passed to connection(), or the database file name.
+    """
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.on_timing = None
+        self._site = os.path.basename(path)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.pool_size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            idle = self._idle
+        try:
+            return idle.get_nowait(), idle
+        except queue.Empty:
+            return self._connect(), idle
+
+    @contextmanager
+    def connection(self, site=None):
+        on_timing = self.on_timing
+        start = time.perf_counter() if on_timing else None
+        conn, idle = self._acquire()
+        try:
+            with conn:  # commits on success, rolls back on error
+                yield conn
+        finally:
+            try:
+                idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+            if on_timing:
+                on_timing(site or self._site, time.perf_counter() - start)
+
+    def stream(self, sql, params=(), chunk=STREAM_CHUNK, site=None):
+        """Yield the rows of a query `chunk` rows at a time.
+
+        The connection stays checked out until the generator is exhausted or
+        closed, so memory use is one chunk however large the result.
+        """
+        with self.connection(site) as conn:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk)
+                if not rows:
+                    return
+                yield from rows
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,31 @@
+import csv
+import json
+
+EXPORT_COLUMNS = {
+    'users': ('id', 'username', 'email', 'phone'),
+    'preferences': ('user_id', 'category', 'preference'),
+}
+
+
+class _Line:
+    # csv.writer wants a file; this one just hands each formatted row back
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row))) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
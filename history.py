@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class MessageHistory:
+    """The last `size` messages of each room, kept only in memory.
+
+    Each room is a fixed-size ring buffer, so a long conversation never grows
+    past `size` entries. Rooms are kept in least-recently-written order and
+    the idlest ones are evicted once there are more than `max_rooms`, or once
+    the text of all the stored messages adds up to more than `max_bytes`
+    (UTF-8). The room just written to is always kept.
+    """
+
+    def __init__(self, size=50, max_rooms=10_000, max_bytes=64 * 1024 * 1024):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # room -> [next seq, deque of (seq, sender sid, message, bytes), bytes]
+        self._rooms = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def append(self, room, sender, message):
+        """Record a message; returns its sequence number within the room."""
+        with self._lock:
+            entry = self._rooms.pop(room, None)
+            if entry is None:
+                entry = [1, deque(maxlen=self.size), 0]
+            self._rooms[room] = entry
+            seq = entry[0]
+            entry[0] += 1
+            size = len(message.encode())
+            grown = size - entry[1][0][3] if len(entry[1]) == self.size else size
+            entry[1].append((seq, sender, message, size))
+            entry[2] += grown
+            self.bytes += grown
+            while len(self._rooms) > self.max_rooms or (self.bytes > self.max_bytes and len(self._rooms) > 1):
+                _, evicted = self._rooms.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.evictions += 1
+        return seq
+
+    def since(self, room, seq):
+        """(seq, sender sid, message) after `seq` still in the buffer, oldest first."""
+        with self._lock:
+            entry = self._rooms.get(room)
+            return [m[:3] for m in entry[1] if m[0] > seq] if entry else []
+
+    def rename(self, room, old_sid, new_sid):
+        # A reconnecting client comes back with a new sid
+        with self._lock:
+            entry = self._rooms.get(room)
+            if entry:
+                entry[1] = deque(((seq, new_sid if sender == old_sid else sender, message, size)
+                                  for seq, sender, message, size in entry[1]), maxlen=self.size)
+
+    def drop(self, room):
+        with self._lock:
+            entry = self._rooms.pop(room, None)
+            if entry:
+                self.bytes -= entry[2]
+
+
+class ReconnectGrace:
+    """Sids that dropped out of a conversation and may still come back.
+
+    hold() starts the clock when a paired client disconnects, claim() lets it
+    resume within `grace` seconds, and expired() hands back the ones that
+    never returned so their pairing can be dissolved.
+    """
+
+    def __init__(self, grace=30.0):
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._away = {}  # sid -> deadline
+
+    def __len__(self):
+        return len(self._away)
+
+    def __contains__(self, sid):
+        return sid in self._away
+
+    def hold(self, sid, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._away[sid] = now + self.grace
+
+    def claim(self, sid, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            deadline = self._away.get(sid)
+            if deadline is None or deadline <= now:
+                return False
+            del self._away[sid]
+            return True
+
+    def forget(self, sid):
+        with self._lock:
+            self._away.pop(sid, None)
+
+    def expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            gone = [sid for sid, deadline in self._away.items() if deadline <= now]
+            for sid in gone:
+                del self._away[sid]
+        return gone
@@ -0,0 +1,188 @@
+"""Load generator for the chat server.
+
+Drives many simulated strangers through the real flow (captcha -> verify ->
+auth -> /chat) with Flask's test client, then runs join/message/typing/skip/
+disconnect against the Socket.IO handlers at the requested per-client rates:
+
+    python loadtest.py --clients 1000 --duration 30 --message-rate 0.5
+
+Everything runs in one process against a throwaway database, so the numbers
+measure the server code itself rather than the network.
+"""
+import argparse
+import heapq
+import html
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The test client only works without a message queue, in threading mode
+os.environ['CHAT_ASYNC_MODE'] = 'threading'
+os.environ.pop('CHAT_MESSAGE_QUEUE', None)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix='chat-loadtest-'))
+
+import app  # noqa: E402
+
+VOCAB = [f"tag{i}" for i in range(200)]
+ACTIONS = ('message', 'typing', 'skip', 'disconnect')
+
+
+class StampedQueue(list):
+    # Records when the server delivered each event, however late we read it
+    def append(self, event):
+        event['received'] = time.perf_counter()
+        super().append(event)
+
+
+class Stranger:
+    def __init__(self, uid=None):
+        self.uid = uid
+        self.http = app.app.test_client()
+        self.sock = None
+        self.room = None
+        self.join_started = None
+
+    def walk_in(self):
+        page = self.http.get('/captcha').get_data(as_text=True)
+        question = html.unescape(re.search(r'<p>(.*?)</p>', page).group(1))
+        answer = next(q['answer'] for q in app.CAPTCHA_QUESTIONS if q['question'] == question)
+        self.http.post('/captcha', data={'captcha': answer})
+        self.http.post('/verify', data={'age_confirm': 'on'})
+        self.http.post('/auth', data={'action': 'skip'})
+        if self.uid:
+            with self.http.session_transaction() as sess:
+                sess['user_id'] = self.uid
+        self.http.get('/chat')
+
+    def connect(self):
+        self.sock = app.socketio.test_client(app.app, flask_test_client=self.http)
+        self.sock.queue = StampedQueue()
+        self.room = None
+        self.join()
+
+    def join(self):
+        self.join_started = time.perf_counter()
+        self.sock.emit('join')
+
+    def drain(self, stats):
+        events, self.sock.queue[:] = list(self.sock.queue), []
+        for event in events:
+            name = event['name']
+            if name == 'partner-found':
+                room = event['args'][0]['room']
+                if room:
+                    self.room = room
+                    if self.join_started is not None:
+                        stats['match'].append(event['received'] - self.join_started)
+                        self.join_started = None
+            elif name == 'partner-left':
+                self.room = None
+                self.join()
+            elif name == 'message':
+                sent = float(event['args']['message'])
+                stats['fanout'].append(event['received'] - sent)
+            elif name == 'rate-limited':
+                stats['limited'] += 1
+
+
+def seed_users(count, rng):
+    with app.db.connection() as conn:
+        for uid in range(1, count + 1):
+            conn.execute("INSERT INTO users (id, username) VALUES (?, ?)", (uid, f"load{uid}"))
+    for uid in range(1, count + 1):
+        app.save_user_preferences(uid, {('interest', tag) for tag in rng.sample(VOCAB, 5)})
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return "n/a"
+    qs = statistics.quantiles(samples, n=100)
+    return "p50 {:.2f} ms  p95 {:.2f} ms  p99 {:.2f} ms".format(qs[49] * 1000, qs[94] * 1000, qs[98] * 1000)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    registered = int(args.clients * args.registered)
+    seed_users(registered, rng)
+    strangers = [Stranger(uid=i + 1 if i < registered else None) for i in range(args.clients)]
+    rng.shuffle(strangers)
+
+    for s in strangers:
+        s.walk_in()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for s in strangers:
+        s.connect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    per_conn = sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / args.clients
+
+    stats = {'match': [], 'fanout': [], 'limited': 0}
+    rates = {'message': args.message_rate, 'typing': args.typing_rate,
+             'skip': args.skip_rate, 'disconnect': args.disconnect_rate}
+    start = time.perf_counter()
+    schedule = []
+    for i in range(args.clients):
+        for action in ACTIONS:
+            if rates[action] > 0:
+                heapq.heappush(schedule, (start + rng.expovariate(rates[action]), i, action))
+
+    emitted = 0
+    end = start + args.duration
+    while schedule and schedule[0][0] < end:
+        due, i, action = heapq.heappop(schedule)
+        heapq.heappush(schedule, (due + rng.expovariate(rates[action]), i, action))
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        s = strangers[i]
+        s.drain(stats)
+        if action == 'disconnect':
+            s.sock.disconnect()
+            s.connect()
+        elif s.room is None:
+            continue
+        elif action == 'message':
+            s.sock.emit('message', {'message': repr(time.perf_counter()), 'room': s.room})
+        elif action == 'typing':
+            s.sock.emit('typing', {'room': s.room})
+        elif action == 'skip':
+            s.sock.emit('skip', {'room': s.room})
+            s.room = None
+            s.join_started = time.perf_counter()
+        emitted += 1
+    elapsed = time.perf_counter() - start
+    for s in strangers:
+        s.drain(stats)
+
+    print(f"clients            {args.clients} ({registered} registered)")
+    print(f"duration           {elapsed:.1f} s")
+    print(f"events emitted     {emitted} ({emitted / elapsed:.0f}/s, {stats['limited']} rate-limited)")
+    print(f"matches            {len(stats['match'])}  {percentiles(stats['match'])}")
+    print(f"message fan-out    {len(stats['fanout'])}  {percentiles(stats['fanout'])}")
+    print(f"memory/connection  {per_conn / 1024:.1f} KiB")
+    print(f"still waiting      {len(app.matchmaker)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=10, help="seconds of chatting after everyone joins")
+    parser.add_argument('--registered', type=float, default=0.5, help="fraction of clients with saved preferences")
+    parser.add_argument('--message-rate', type=float, default=0.5, help="messages per client per second")
+    parser.add_argument('--typing-rate', type=float, default=2.0, help="typing events per client per second")
+    parser.add_argument('--skip-rate', type=float, default=0.05, help="skips per client per second")
+    parser.add_argument('--disconnect-rate', type=float, default=0.01, help="reconnects per client per second")
+    parser.add_argument('--seed', type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
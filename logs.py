@@ -0,0 +1,18 @@
+import logging
+import random
+
+logger = logging.getLogger('chat')
+
+
+def log_event(level, event, sample=1.0, **fields):
+    """Log `event` with key=value fields, e.g. `match sid=... partner=...`.
+
+    Checks the level before doing any formatting, so a disabled level costs
+    one method call. `sample` keeps only that fraction of the events, for
+    ones fired on every join or message.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample < 1.0 and random.random() >= sample:
+        return
+    logger.log(level, "%s %s", event, " ".join(f"{key}={value}" for key, value in fields.items()))
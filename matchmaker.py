@@ -0,0 +1,445 @@
+import itertools
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+
+
+def preference_tags(prefs):
+    # {'interest': ['gaming', 'books']} -> {('interest', 'gaming'), ('interest', 'books')}
+    return frozenset((cat, pref) for cat, values in prefs.items() for pref in values)
+
+
+def overlap(ids, other_ids):
+    """Shared tags between two sorted tuples of tag ids (tags.id values).
+
+    A sorted merge, so comparing two waiting users allocates nothing. In pure
+    Python that is slower than intersecting sets in C (roughly 0.6x a
+    frozenset `&`); what it buys is entries a fifth the size and no garbage
+    per comparison. `python bench.py overlap` has the numbers.
+    """
+    i = j = shared = 0
+    n, m = len(ids), len(other_ids)
+    while i < n and j < m:
+        a, b = ids[i], other_ids[j]
+        if a == b:
+            shared += 1
+            i += 1
+            j += 1
+        elif a < b:
+            i += 1
+        else:
+            j += 1
+    return shared
+
+
+def wait_percentiles(waits):
+    if not waits:
+        return {'p50': None, 'p95': None, 'p99': None}
+    if len(waits) == 1:
+        return {'p50': waits[0], 'p95': waits[0], 'p99': waits[0]}
+    qs = statistics.quantiles(waits, n=100, method='inclusive')
+    return {'p50': qs[49], 'p95': qs[94], 'p99': qs[98]}
+
+
+class MatchWaits:
+    """Recent time-to-match samples; `observer`, if set, sees every one."""
+
+    def __init__(self, samples=1000):
+        self._waits = deque(maxlen=samples)
+        self.observer = None
+
+    def record(self, seconds):
+        self._waits.append(seconds)
+        if self.observer is not None:
+            self.observer(seconds)
+
+    def percentiles(self):
+        return wait_percentiles(list(self._waits))
+
+
+def best_partner(uid, tag_ids, candidates, now, min_overlap, relax_after):
+    """The sid a joiner should pair with, or None; see Matchmaker for the rules.
+
+    `candidates` are (sid, seq, uid, tag ids, joined) of waiting users.
+    """
+    best, best_key = None, None
+    for other_sid, seq, other_uid, other_ids, joined in candidates:
+        credit = int((now - joined) / relax_after)
+        shared = overlap(tag_ids, other_ids)
+        if uid and other_uid and shared + credit < min_overlap:
+            continue
+        # Most shared tags plus waiting credit wins, longest wait breaks ties
+        key = (shared + credit, -seq)
+        if best_key is None or key > best_key:
+            best, best_key = other_sid, key
+    return best
+
+
+def batch_pairs(pool, now, min_overlap=1, relax_after=10.0, neighbours=16):
+    """Pair a whole waiting pool at once; returns a list of (i, j) indexes.
+
+    `pool` is a list of (uid, tag ids, joined), oldest first. The overlap
+    matrix is sparse, so candidate pairs come from tag posting lists rather
+    than from comparing every pair: within each list a user is only paired
+    with its `neighbours` closest entries by wait time, which bounds the work
+    at O(users * tags * neighbours) however popular a tag is. Edges are then
+    taken heaviest first, the usual greedy approximation of a maximum-weight
+    matching, with the same acceptance rule and waiting credit as
+    Matchmaker. Leftover guests are then paired with anyone, oldest first,
+    and users who have waited long enough with each other.
+    """
+    credit = [int((now - joined) / relax_after) for _, _, joined in pool]
+    tag_ids = [ids for _, ids, _ in pool]
+    postings = {}
+    for i, ids in enumerate(tag_ids):
+        for tag_id in ids:
+            postings.setdefault(tag_id, []).append(i)
+
+    candidates = set()
+    half = neighbours // 2
+    for members in postings.values():
+        for k, i in enumerate(members):
+            candidates.update(zip(itertools.repeat(i), members[k + 1:k + 1 + half]))
+
+    # Weights are small integers, so bucket the edges instead of sorting them
+    buckets = {}
+    for i, j in candidates:
+        shared = overlap(tag_ids[i], tag_ids[j])
+        if shared + credit[i] >= min_overlap and shared + credit[j] >= min_overlap:
+            buckets.setdefault(shared + credit[i] + credit[j], []).append((i, j))
+
+    paired = [False] * len(pool)
+    pairs = []
+    for weight in sorted(buckets, reverse=True):
+        for i, j in buckets[weight]:
+            if not paired[i] and not paired[j]:
+                paired[i] = paired[j] = True
+                pairs.append((i, j))
+
+    guests = deque(i for i, (uid, _, _) in enumerate(pool) if not paired[i] and not uid)
+    relaxed = []
+    for i, (uid, _, _) in enumerate(pool):
+        if paired[i] or not uid:
+            continue
+        if guests:
+            pairs.append((i, guests.popleft()))
+        elif credit[i] >= min_overlap:
+            relaxed.append(i)
+    guests = list(guests)
+    pairs.extend(zip(relaxed[::2], relaxed[1::2]))
+    pairs.extend(zip(guests[::2], guests[1::2]))
+    return pairs
+
+
+class Matchmaker:
+    """Waiting pool for strangers looking for a partner.
+
+    Registered users are indexed by tag, and a joiner only scores the
+    `candidates` longest-waiting users of each of its tags (plus the oldest
+    waiting user and the oldest guest), so a join costs O(tags * candidates)
+    however big the pool or popular the tag. Someone further down a busy
+    tag's list is reached as those ahead of them are matched, and they are
+    the ones with the most waiting credit anyway. A waiting user's score is the
+    number of shared tags plus one for every `relax_after` seconds it has
+    waited, and it only accepts a partner once that score reaches
+    `min_overlap`. Guests accept anyone and everyone accepts a guest. So a user with niche preferences
+    starts out picky, gets less picky the longer it waits, and is eventually
+    preferred over newer arrivals instead of waiting forever.
+
+    Everyone relaxes on the same schedule, so the insertion-ordered entries
+    dict doubles as the wait-time priority queue: the oldest entry is always
+    the most relaxed one.
+    """
+
+    def __init__(self, min_overlap=1, relax_after=10.0, samples=1000, candidates=32):
+        self.min_overlap = min_overlap
+        self.relax_after = relax_after
+        self.candidates = candidates
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._entries = {}   # sid -> (seq, uid, tag ids, joined), insertion ordered
+        self._guests = {}    # sid -> None, insertion ordered
+        self._index = {}     # tag id -> {sid: None}, insertion ordered
+        self.waits = MatchWaits(samples)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, sid):
+        return sid in self._entries
+
+    def join(self, sid, uid, tag_ids, now=None):
+        """Pair `sid` with a waiting user, or queue it.
+
+        `tag_ids` is the user's sorted tags.id values, () for guests.
+        Returns the partner sid, or None if `sid` is now waiting.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._remove(sid)
+            other_sid = self._find(uid, tag_ids, now)
+            if other_sid is not None:
+                self.waits.record(now - self._entries[other_sid][3])
+                self._remove(other_sid)
+                return other_sid
+            self._add(sid, uid, tag_ids, now)
+            return None
+
+    def remove(self, sid):
+        with self._lock:
+            return self._remove(sid)
+
+    def enqueue(self, sid, uid, tag_ids, now=None):
+        """Queue `sid` for the next match_pending() without matching now."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._remove(sid)
+            self._add(sid, uid, tag_ids, now)
+
+    def match_pending(self, now=None):
+        """Pair as much of the waiting pool as possible.
+
+        Returns pairs of (sid, uid, tag ids, joined) entries, already taken
+        out of the pool; enqueue(*entry) puts one back as it was.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            snapshot = list(self._entries.items())
+        # batch_pairs takes seconds on a big pool, so joins and disconnects
+        # go on meanwhile; a pair whose entries changed since is dropped
+        pool = [entry[1:] for _, entry in snapshot]
+        candidates = batch_pairs(pool, now, self.min_overlap, self.relax_after)
+        pairs = []
+        with self._lock:
+            for i, j in candidates:
+                (sid, entry), (other_sid, other) = snapshot[i], snapshot[j]
+                if self._entries.get(sid) is not entry or self._entries.get(other_sid) is not other:
+                    continue
+                for k in (i, j):
+                    self.waits.record(now - pool[k][2])
+                    self._remove(snapshot[k][0])
+                pairs.append(((sid, *pool[i]), (other_sid, *pool[j])))
+        return pairs
+
+    def stats(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tiers = {}
+            for _, uid, _, joined in self._entries.values():
+                tier = self._tier(uid, joined, now)
+                tiers[tier] = tiers.get(tier, 0) + 1
+        return {'waiting': len(self), 'tiers': dict(sorted(tiers.items())),
+                'time_to_match': self.waits.percentiles()}
+
+    def _tier(self, uid, joined, now):
+        # Shared tags still required before this waiting user accepts anyone
+        if not uid:
+            return 0
+        return max(0, self.min_overlap - int((now - joined) / self.relax_after))
+
+    def _find(self, uid, tag_ids, now):
+        sids = {}
+        for tag_id in tag_ids:
+            sids.update(dict.fromkeys(itertools.islice(self._index.get(tag_id, ()), self.candidates)))
+        # Whoever has waited longest, or the longest waiting guest, may be
+        # acceptable without sharing anything
+        for other_sid in (next(iter(self._entries), None), next(iter(self._guests), None)):
+            if other_sid is not None:
+                sids[other_sid] = None
+        entries = self._entries
+        return best_partner(uid, tag_ids, ((sid, *entries[sid]) for sid in sids),
+                            now, self.min_overlap, self.relax_after)
+
+    def _add(self, sid, uid, tag_ids, now):
+        self._entries[sid] = (next(self._seq), uid, tag_ids, now)
+        if not uid:
+            self._guests[sid] = None
+        for tag_id in tag_ids:
+            self._index.setdefault(tag_id, {})[sid] = None
+
+    def _remove(self, sid):
+        entry = self._entries.pop(sid, None)
+        if entry is None:
+            return False
+        self._guests.pop(sid, None)
+        for tag_id in entry[2]:
+            sids = self._index[tag_id]
+            sids.pop(sid, None)
+            if not sids:
+                del self._index[tag_id]
+        return True
+
+
+class SqliteMatchmaker:
+    """Waiting pool shared by every worker that opens the same database.
+
+    Same matching rules as Matchmaker, but the pool lives in two sqlite tables
+    so gunicorn workers on one host draw from a single global queue. Each
+    join runs as one IMMEDIATE transaction, so two workers can never claim
+    the same partner. Join times are wall-clock so every worker agrees on
+    how long someone has waited; time-to-match samples are per worker.
+
+    Batch ticks are run by one worker at a time, whichever holds the
+    `lease` row; if it dies another takes over once the lease runs out.
+    """
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS waiting (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        sid TEXT NOT NULL UNIQUE,
+        uid INTEGER,
+        joined REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS waiting_guests ON waiting (uid, seq);
+    CREATE TABLE IF NOT EXISTS waiting_tags (
+        tag_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        sid TEXT NOT NULL,
+        PRIMARY KEY (tag_id, seq)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS waiting_tags_sid ON waiting_tags (sid);
+    CREATE TABLE IF NOT EXISTS matcher_lease (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        owner TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+    '''
+
+    def __init__(self, db, min_overlap=1, relax_after=10.0, samples=1000, candidates=32, lease=10.0):
+        self.db = db
+        self.min_overlap = min_overlap
+        self.relax_after = relax_after
+        self.candidates = candidates
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self.waits = MatchWaits(samples)
+        with db.connection() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(waiting_tags)")}
+            if columns and 'seq' not in columns:  # pool created before tags were kept as tags.id
+                conn.execute("DROP TABLE waiting_tags")
+            conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(waiting)")}
+            if 'joined' not in columns:  # pool created before join times were kept
+                conn.execute("ALTER TABLE waiting ADD COLUMN joined REAL NOT NULL DEFAULT 0")
+
+    def __len__(self):
+        with self.db.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM waiting").fetchone()[0]
+
+    def __contains__(self, sid):
+        with self.db.connection() as conn:
+            return conn.execute("SELECT 1 FROM waiting WHERE sid=?", (sid,)).fetchone() is not None
+
+    def join(self, sid, uid, tag_ids, now=None):
+        now = time.time() if now is None else now
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._remove(conn, sid)
+            found = self._find(conn, uid, tag_ids, now)
+            if found is not None:
+                other_sid, joined = found
+                self.waits.record(now - joined)
+                self._remove(conn, other_sid)
+                return other_sid
+            self._add(conn, sid, uid, tag_ids, now)
+            return None
+
+    def remove(self, sid):
+        with self.db.connection() as conn:
+            return self._remove(conn, sid)
+
+    def enqueue(self, sid, uid, tag_ids, now=None):
+        now = time.time() if now is None else now
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._remove(conn, sid)
+            self._add(conn, sid, uid, tag_ids, now)
+
+    def match_pending(self, now=None):
+        now = time.time() if now is None else now
+        if not self._renew_lease(now):
+            return []
+        # Read a snapshot and pair it with no lock held: batch_pairs takes
+        # seconds on a big pool, and every other worker's joins and removes
+        # need the write lock meanwhile
+        with self.db.connection() as conn:
+            conn.execute("BEGIN")
+            rows = conn.execute("SELECT sid, seq, uid, joined FROM waiting ORDER BY seq").fetchall()
+            tags = {}
+            for sid, tag_id in conn.execute("SELECT sid, tag_id FROM waiting_tags ORDER BY sid, tag_id"):
+                tags.setdefault(sid, []).append(tag_id)
+        pool = [(uid, tuple(tags.get(sid, ())), joined) for sid, _, uid, joined in rows]
+        candidates = batch_pairs(pool, now, self.min_overlap, self.relax_after)
+        # A pair whose entries left or re-joined (new seq) since is dropped
+        pairs = []
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            current = dict(conn.execute("SELECT sid, seq FROM waiting"))
+            for i, j in candidates:
+                if all(current.get(rows[k][0]) == rows[k][1] for k in (i, j)):
+                    pairs.append((i, j))
+            matched = [(rows[k][0],) for pair in pairs for k in pair]
+            conn.executemany("DELETE FROM waiting WHERE sid=?", matched)
+            conn.executemany("DELETE FROM waiting_tags WHERE sid=?", matched)
+        for pair in pairs:
+            for k in pair:
+                self.waits.record(now - rows[k][3])
+        return [((rows[i][0], *pool[i]), (rows[j][0], *pool[j])) for i, j in pairs]
+
+    def _renew_lease(self, now):
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO matcher_lease (id, owner, expires) VALUES (1, ?, 0)", (self.owner,))
+            return conn.execute("UPDATE matcher_lease SET owner=?, expires=? WHERE id=1 AND (owner=? OR expires<?)",
+                                (self.owner, now + self.lease, self.owner, now)).rowcount > 0
+
+    def clear(self):
+        with self.db.connection() as conn:
+            conn.execute("DELETE FROM waiting")
+            conn.execute("DELETE FROM waiting_tags")
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        with self.db.connection() as conn:
+            rows = conn.execute("""SELECT CASE WHEN uid IS NULL THEN 0
+                                          ELSE MAX(0, ? - CAST((? - joined) / ? AS INTEGER)) END AS tier,
+                                          COUNT(*)
+                                   FROM waiting GROUP BY tier ORDER BY tier""",
+                                (self.min_overlap, now, self.relax_after)).fetchall()
+        return {'waiting': sum(n for _, n in rows), 'tiers': dict(rows),
+                'time_to_match': self.waits.percentiles()}
+
+    def _find(self, conn, uid, tag_ids, now):
+        # The same bounded candidate walk as Matchmaker: each tag's oldest
+        # entries are an index range on waiting_tags (tag_id, seq)
+        sids = {}
+        for tag_id in tag_ids:
+            sids.update(dict.fromkeys(sid for (sid,) in conn.execute(
+                "SELECT sid FROM waiting_tags WHERE tag_id=? ORDER BY seq LIMIT ?", (tag_id, self.candidates))))
+        for where in ("", "WHERE uid IS NULL"):
+            row = conn.execute(f"SELECT sid FROM waiting {where} ORDER BY seq LIMIT 1").fetchone()
+            if row is not None:
+                sids[row[0]] = None
+        if not sids:
+            return None
+        marks = ", ".join("?" * len(sids))
+        entries = {sid: (seq, other_uid, [], joined) for sid, seq, other_uid, joined in conn.execute(
+            f"SELECT sid, seq, uid, joined FROM waiting WHERE sid IN ({marks})", list(sids))}
+        for sid, tag_id in conn.execute(
+                f"SELECT sid, tag_id FROM waiting_tags WHERE sid IN ({marks}) ORDER BY sid, tag_id", list(sids)):
+            entries[sid][2].append(tag_id)
+        sid = best_partner(uid, tag_ids, ((sid, *entry) for sid, entry in entries.items()),
+                           now, self.min_overlap, self.relax_after)
+        return None if sid is None else (sid, entries[sid][3])
+
+    def _add(self, conn, sid, uid, tag_ids, now):
+        seq = conn.execute("INSERT INTO waiting (sid, uid, joined) VALUES (?, ?, ?)", (sid, uid, now)).lastrowid
+        conn.executemany("INSERT INTO waiting_tags (tag_id, seq, sid) VALUES (?, ?, ?)",
+                         [(tag_id, seq, sid) for tag_id in tag_ids])
+
+    def _remove(self, conn, sid):
+        removed = conn.execute("DELETE FROM waiting WHERE sid=?", (sid,)).rowcount
+        conn.execute("DELETE FROM waiting_tags WHERE sid=?", (sid,))
+        return removed > 0
@@ -0,0 +1,186 @@
+import bisect
+import threading
+import time
+
+# Seconds; from sub-millisecond handler calls up to minutes in the queue
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Base class; with `fn`, samples are read from it at scrape time.
+
+    `fn` returns either a number or, for a labelled metric, a dict of label
+    tuple -> number.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._child())
+        return child
+
+    def samples(self):
+        if self.fn is not None:
+            value = self.fn()
+            if not isinstance(value, dict):
+                value = {(): value}
+            for values, v in value.items():
+                yield self.name + _format_labels(self.labelnames, values), v
+            return
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name} {_format_value(value)}" for name, value in self.samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labelnames, values):
+        yield name + _format_labels(labelnames, values), self.value
+
+
+class Counter(Metric):
+    type = 'counter'
+    _child = _Value
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A value that is set, or read from `fn` at scrape time."""
+
+    type = 'gauge'
+    _child = _Value
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _Buckets:
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format_value(bound)
+            yield name + '_bucket' + _format_labels(labelnames, values, [('le', le)]), cumulative
+        labels = _format_labels(labelnames, values)
+        yield name + '_sum' + labels, total
+        yield name + '_count' + labels, cumulative
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class RecentEvents:
+    """How many events happened in the last `window` seconds.
+
+    One bucket per second, reused as the clock comes round, so add() is O(1)
+    and memory is `window` buckets however busy it gets.
+    """
+
+    def __init__(self, window=60):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counts = [0] * window
+        self._seconds = [None] * window
+
+    def add(self, n=1, now=None):
+        second = int(time.monotonic() if now is None else now)
+        i = second % self.window
+        with self._lock:
+            if self._seconds[i] != second:
+                self._seconds[i] = second
+                self._counts[i] = 0
+            self._counts[i] += n
+
+    def total(self, now=None):
+        second = int(time.monotonic() if now is None else now)
+        with self._lock:
+            return sum(count for count, at in zip(self._counts, self._seconds)
+                       if at is not None and second - at < self.window)
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self.register(Counter(name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
@@ -0,0 +1,163 @@
+import logging
+import sqlite3
+
+from logs import log_event
+
+# Schema history. Each entry is applied once, in order, and the database's
+# PRAGMA user_version records how far it has got. Never edit a migration that
+# has shipped; append a new one instead.
+MIGRATIONS = [
+    # 1: original schema
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        email TEXT,
+        phone TEXT,
+        is_admin INTEGER DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS preferences (
+        user_id INTEGER,
+        category TEXT,
+        preference TEXT
+    );
+    ''',
+    # 2: indexes for login, preference lookups and matching
+    '''
+    -- Older databases may hold duplicate usernames; keep the oldest account
+    -- as-is and suffix the rest so the unique index can be built.
+    UPDATE users SET username = username || '#' || id
+    WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY username);
+    CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username);
+
+    DELETE FROM preferences WHERE rowid NOT IN (
+        SELECT MIN(rowid) FROM preferences GROUP BY user_id, category, preference
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS preferences_user
+        ON preferences (user_id, category, preference);
+    CREATE INDEX IF NOT EXISTS preferences_tag
+        ON preferences (category, preference, user_id);
+    ''',
+    # 3: normalized tag dictionary with stable integer ids
+    '''
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        category TEXT NOT NULL,
+        preference TEXT NOT NULL,
+        UNIQUE (category, preference)
+    );
+    INSERT OR IGNORE INTO tags (category, preference)
+        SELECT DISTINCT category, preference FROM preferences
+        WHERE category IS NOT NULL AND preference IS NOT NULL;
+    CREATE TRIGGER IF NOT EXISTS preferences_tag_insert AFTER INSERT ON preferences
+    BEGIN
+        INSERT OR IGNORE INTO tags (category, preference) VALUES (NEW.category, NEW.preference);
+    END;
+    ''',
+    # 4: per-tag user counts for preference suggestions, maintained by triggers
+    '''
+    ALTER TABLE tags ADD COLUMN user_count INTEGER NOT NULL DEFAULT 0;
+    UPDATE tags SET user_count = (
+        SELECT COUNT(*) FROM preferences p
+        WHERE p.category = tags.category AND p.preference = tags.preference
+    );
+    CREATE INDEX IF NOT EXISTS tags_user_count ON tags (user_count);
+
+    DROP TRIGGER IF EXISTS preferences_tag_insert;
+    CREATE TRIGGER preferences_tag_insert AFTER INSERT ON preferences
+    BEGIN
+        INSERT OR IGNORE INTO tags (category, preference) VALUES (NEW.category, NEW.preference);
+        UPDATE tags SET user_count = user_count + 1
+        WHERE category = NEW.category AND preference = NEW.preference;
+    END;
+    CREATE TRIGGER IF NOT EXISTS preferences_tag_delete AFTER DELETE ON preferences
+    BEGIN
+        UPDATE tags SET user_count = user_count - 1
+        WHERE category = OLD.category AND preference = OLD.preference;
+    END;
+    ''',
+    # 5: password hashes; accounts made before this have none and cannot log in
+    '''
+    ALTER TABLE users ADD COLUMN password TEXT;
+    ''',
+    # 6: row counts for the admin dashboard, maintained by triggers
+    '''
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR REPLACE INTO counters (name, value) VALUES
+        ('users', (SELECT COUNT(*) FROM users)),
+        ('preference_users', (SELECT COUNT(DISTINCT user_id) FROM preferences));
+
+    CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_count_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'users';
+    END;
+    -- a user's first preference row counts them, their last one going uncounts them
+    CREATE TRIGGER IF NOT EXISTS preference_users_insert AFTER INSERT ON preferences
+    WHEN NEW.user_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM preferences WHERE user_id = NEW.user_id AND rowid != NEW.rowid
+    )
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'preference_users';
+    END;
+    CREATE TRIGGER IF NOT EXISTS preference_users_delete AFTER DELETE ON preferences
+    WHEN OLD.user_id IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM preferences WHERE user_id = OLD.user_id
+    )
+    BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'preference_users';
+    END;
+    ''',
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# How long a worker waits for another one that is already migrating
+MIGRATE_BUSY_TIMEOUT = 600_000  # ms
+
+
+def statements(script):
+    # executescript() would commit the transaction migrate() holds, so run
+    # the statements one by one; complete_statement() knows that a trigger's
+    # BEGIN ... END has semicolons inside it
+    buffer = ''
+    for piece in script.split(';'):
+        buffer += piece + ';'
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(' \n;'):
+                yield buffer
+            buffer = ''
+
+
+def migrate(conn):
+    # Workers booting together race to migrate. Reading user_version and
+    # bumping it under one write lock makes every step run exactly once.
+    busy_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute(f"PRAGMA busy_timeout = {MIGRATE_BUSY_TIMEOUT}")
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = schema_version(conn)
+                if version >= len(MIGRATIONS):
+                    conn.rollback()
+                    return version
+                log_event(logging.INFO, 'migrate', version=version + 1)
+                for statement in statements(MIGRATIONS[version]):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    finally:
+        conn.execute(f"PRAGMA busy_timeout = {busy_timeout}")
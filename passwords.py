@@ -0,0 +1,45 @@
+import os
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from blocking import run_blocking
+
+# Any werkzeug method string: 'scrypt', 'scrypt:32768:8:1', 'pbkdf2:sha256:600000'...
+DEFAULT_METHOD = 'scrypt'
+
+
+class PasswordHasher:
+    """Hashes and checks passwords off the event loop, a few at a time.
+
+    hashlib's scrypt and pbkdf2 release the GIL, so the native threads behind
+    run_blocking hash in parallel; `workers` caps how many run at once so a
+    burst of registrations queues up instead of taking every core away from
+    the Socket.IO heartbeats.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=None):
+        self.method = method
+        self.workers = workers or os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._prefix = None
+
+    def _run(self, fn, *args):
+        with self._slots:
+            return run_blocking(fn, *args)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        if not stored or password is None:
+            return False
+        return self._run(check_password_hash, stored, password)
+
+    def needs_rehash(self, stored):
+        """Whether `stored` was made with a different method or work factor."""
+        if self._prefix is None:
+            # werkzeug fills in defaults ('scrypt' is written as
+            # 'scrypt:32768:8:1'), so compare with what it actually writes
+            self._prefix = self.hash('').split('$', 1)[0]
+        return stored.split('$', 1)[0] != self._prefix
@@ -0,0 +1,130 @@
+import _thread
+import cProfile
+import functools
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+MODES = ('cprofile', 'sample')
+
+
+def _native_thread():
+    # The sampler has to interrupt running handlers, so under gevent/eventlet
+    # it needs a real OS thread (and a real sleep), not a patched greenlet
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        return monkey.get_original('_thread', 'start_new_thread'), monkey.get_original('time', 'sleep')
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        return patcher.original('_thread').start_new_thread, patcher.original('time').sleep
+    return _thread.start_new_thread, time.sleep
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """Opt-in profiling of Flask views and Socket.IO handlers.
+
+    Wrap each handler with `wrap()`; while the profiler is off the wrapper
+    costs one attribute check. `start('cprofile', rate)` runs cProfile on
+    that fraction of calls, one at a time, and merges the results.
+    `start('sample', interval=...)` instead records, every `interval`
+    seconds, the stack of each thread that is inside a wrapped handler, as
+    collapsed stacks ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.rate = 0.01
+        self.interval = 0.005
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._generation = 0
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self._stacks = {}
+            self.profiled = 0
+            self.samples = 0
+            self.started = time.time()
+
+    def start(self, mode, rate=None, interval=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown profiling mode {mode!r}")
+        if rate is not None:
+            self.rate = rate
+        if interval is not None:
+            self.interval = interval
+        self.mode = mode
+        if mode == 'sample':
+            self._generation += 1
+            start_thread, sleep = _native_thread()
+            start_thread(self._sample, (self._generation, sleep))
+
+    def stop(self):
+        self.mode = None
+
+    def wrap(self, fn):
+        @functools.wraps(fn)
+        def profiled(*args, **kwargs):
+            if self.mode != 'cprofile' or random.random() >= self.rate or not self._busy.acquire(False):
+                return fn(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(fn, *args, **kwargs)
+            finally:
+                self._busy.release()
+                self._merge(profile)
+        return profiled
+
+    def _merge(self, profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.profiled += 1
+
+    def _sample(self, generation, sleep):
+        marker = self.wrap(lambda: None).__code__
+        while self.mode == 'sample' and self._generation == generation:
+            stacks = self._stacks
+            for frame in sys._current_frames().values():
+                names = []
+                while frame is not None and frame.f_code is not marker:
+                    names.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                if frame is not None:
+                    stack = ';'.join(reversed(names))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+            self.samples += 1
+            sleep(self.interval)
+
+    def top_functions(self, n=30):
+        """The n functions with the most cumulative time, as pstats prints them."""
+        with self._lock:
+            if self._stats is None:
+                return ''
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats('cumulative').print_stats(n)
+        return out.getvalue()
+
+    def top_stacks(self, n=None):
+        """Collapsed `frame;frame;frame count` lines, most sampled first."""
+        stacks = sorted(dict(self._stacks).items(), key=lambda item: item[1], reverse=True)
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks[:n])
+
+    def pstats_dump(self):
+        """The merged cProfile results in the format pstats.Stats() loads."""
+        with self._lock:
+            return marshal.dumps(self._stats.stats) if self._stats is not None else None
@@ -0,0 +1,80 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket per key: `rate` tokens a second, at most `burst` saved up."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> [tokens, last refill]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+            return True
+
+    def forget(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class TypingCoalescer:
+    """Collapse a stream of keypress `typing` events into start/stop signals.
+
+    touch() says whether this keypress should be forwarded to `target` (the
+    partner): at most once per `window` seconds per sender. expired() hands
+    back the senders who have gone quiet for `stop_after` seconds so a
+    "stopped typing" can be sent.
+    """
+
+    def __init__(self, window=1.0, stop_after=3.0):
+        self.window = window
+        self.stop_after = stop_after
+        self._lock = threading.Lock()
+        self._typing = {}  # sid -> [target, last broadcast, last keypress]
+
+    def __len__(self):
+        return len(self._typing)
+
+    def touch(self, sid, target, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self._typing.get(sid)
+            if state is None or state[0] != target:
+                self._typing[sid] = [target, now, now]
+                return True
+            state[2] = now
+            if now - state[1] >= self.window:
+                state[1] = now
+                return True
+            return False
+
+    def stop(self, sid):
+        """Forget `sid`; returns who it was typing to, if anyone."""
+        with self._lock:
+            state = self._typing.pop(sid, None)
+        return state and state[0]
+
+    def expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            quiet = [(sid, state[0]) for sid, state in self._typing.items()
+                     if now - state[2] >= self.stop_after]
+            for sid, _ in quiet:
+                del self._typing[sid]
+        return quiet
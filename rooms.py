@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import uuid
+
+
+class AlreadyPaired(Exception):
+    pass
+
+
+def new_room_id():
+    return uuid.uuid4().hex
+
+
+class RoomRegistry:
+    """Who is talking to whom, so events are routed by the server.
+
+    Every paired sid maps to its room and partner, and every room to its
+    members. A room only ever holds the two strangers it was created for, and
+    is dissolved as a whole when either side leaves, so nothing outlives the
+    conversation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_sid = {}    # sid -> (room, partner sid)
+        self._members = {}   # room -> tuple of sids
+
+    def __len__(self):
+        return len(self._members)
+
+    def pair(self, sid, other_sid):
+        room = new_room_id()
+        with self._lock:
+            for s in (sid, other_sid):
+                if s in self._by_sid:
+                    raise AlreadyPaired(s)
+            self._members[room] = (sid, other_sid)
+            self._by_sid[sid] = (room, other_sid)
+            self._by_sid[other_sid] = (room, sid)
+        return room
+
+    def lookup(self, sid):
+        """(room, partner) for a paired sid, otherwise None."""
+        return self._by_sid.get(sid)
+
+    def partner(self, sid):
+        entry = self._by_sid.get(sid)
+        return entry and entry[1]
+
+    def room(self, sid):
+        entry = self._by_sid.get(sid)
+        return entry and entry[0]
+
+    def members(self, room):
+        return self._members.get(room, ())
+
+    def leave(self, sid):
+        """Dissolve sid's pairing; returns (room, partner) or None."""
+        with self._lock:
+            entry = self._by_sid.pop(sid, None)
+            if entry is None:
+                return None
+            room, partner = entry
+            for member in self._members.pop(room, ()):
+                self._by_sid.pop(member, None)
+        return room, partner
+
+    def rebind(self, old_sid, new_sid):
+        """Move old_sid's seat in its pairing over to new_sid."""
+        with self._lock:
+            entry = self._by_sid.pop(old_sid, None)
+            if entry is None:
+                return False
+            room, partner = entry
+            self._by_sid[new_sid] = entry
+            self._by_sid[partner] = (room, new_sid)
+            self._members[room] = tuple(new_sid if s == old_sid else s for s in self._members[room])
+        return True
+
+
+class SqliteRoomRegistry:
+    """RoomRegistry shared between the workers that open the same database."""
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS pairs (
+        sid TEXT PRIMARY KEY,
+        room TEXT NOT NULL,
+        partner TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS pairs_room ON pairs (room);
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        with db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def __len__(self):
+        with self.db.connection() as conn:
+            return conn.execute("SELECT COUNT(DISTINCT room) FROM pairs").fetchone()[0]
+
+    def pair(self, sid, other_sid):
+        room = new_room_id()
+        try:
+            with self.db.connection() as conn:
+                conn.executemany("INSERT INTO pairs (sid, room, partner) VALUES (?, ?, ?)",
+                                 [(sid, room, other_sid), (other_sid, room, sid)])
+        except sqlite3.IntegrityError:
+            raise AlreadyPaired(sid, other_sid)
+        return room
+
+    def lookup(self, sid):
+        with self.db.connection() as conn:
+            entry = conn.execute("SELECT room, partner FROM pairs WHERE sid=?", (sid,)).fetchone()
+        return entry and tuple(entry)
+
+    def partner(self, sid):
+        entry = self.lookup(sid)
+        return entry and entry[1]
+
+    def room(self, sid):
+        entry = self.lookup(sid)
+        return entry and entry[0]
+
+    def members(self, room):
+        with self.db.connection() as conn:
+            return tuple(r[0] for r in conn.execute("SELECT sid FROM pairs WHERE room=?", (room,)))
+
+    def leave(self, sid):
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            entry = conn.execute("SELECT room, partner FROM pairs WHERE sid=?", (sid,)).fetchone()
+            if entry is None:
+                return None
+            conn.execute("DELETE FROM pairs WHERE room=?", (entry[0],))
+        return tuple(entry)
+
+    def rebind(self, old_sid, new_sid):
+        with self.db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if not conn.execute("UPDATE pairs SET sid=? WHERE sid=?", (new_sid, old_sid)).rowcount:
+                return False
+            conn.execute("UPDATE pairs SET partner=? WHERE partner=?", (new_sid, old_sid))
+        return True
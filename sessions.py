@@ -0,0 +1,210 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_TTL = 24 * 3600
+SESSION_REFRESH = 3600
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaces = None
+
+    def regenerate(self):
+        """Keep the data but move it to a fresh id; the old id is dropped on save."""
+        if not self.new:
+            self.replaces = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class MemorySessionStore:
+    """Bounded in-process session store.
+
+    Entries are kept in use order, which with a single TTL is also expiry
+    order: the sweep only ever looks at the front of the dict, and when the
+    store is full the least recently used session is evicted. A read moves
+    the entry to the back and restarts its TTL, at most once per `refresh`
+    seconds.
+    """
+
+    def __init__(self, max_entries=100_000, ttl=SESSION_TTL, refresh=SESSION_REFRESH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # sid -> (expires, data)
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, sid, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if entry[0] - now < self.ttl - self.refresh:
+                self._data[sid] = (now + self.ttl, entry[1])
+                self._data.move_to_end(sid)
+            return dict(entry[1])
+
+    def set(self, sid, data, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._data.pop(sid, None)
+            self._data[sid] = (now + self.ttl, dict(data))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        with self._lock:
+            while self._data:
+                sid, (expires, _) = next(iter(self._data.items()))
+                if expires > now:
+                    break
+                del self._data[sid]
+                removed += 1
+            self.expired += removed
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'expired': self.expired}
+
+
+class SqliteSessionStore:
+    """Session store shared by every worker that opens the same database."""
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+    '''
+
+    def __init__(self, db, ttl=SESSION_TTL, refresh=SESSION_REFRESH):
+        self.db = db
+        self.ttl = ttl
+        self.refresh = refresh
+        self.serializer = TaggedJSONSerializer()
+        self.hits = self.misses = self.evictions = self.expired = 0
+        with db.connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def __len__(self):
+        with self.db.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get(self, sid, now=None):
+        now = time.time() if now is None else now
+        with self.db.connection() as conn:
+            row = conn.execute("SELECT data, expires FROM sessions WHERE id=? AND expires > ?", (sid, now)).fetchone()
+            if row is not None and row[1] - now < self.ttl - self.refresh:
+                conn.execute("UPDATE sessions SET expires=? WHERE id=?", (now + self.ttl, sid))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.serializer.loads(row[0])
+
+    def set(self, sid, data, now=None):
+        now = time.time() if now is None else now
+        with self.db.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+                         (sid, self.serializer.dumps(dict(data)), now + self.ttl))
+
+    def delete(self, sid):
+        with self.db.connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id=?", (sid,))
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self.db.connection() as conn:
+            removed = conn.execute("DELETE FROM sessions WHERE expires <= ?", (now,)).rowcount
+        self.expired += removed
+        return removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'expired': self.expired}
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keep session data on the server; the cookie only holds a random id.
+
+    Socket.IO events run in request contexts built from the connection's
+    handshake environ, so the session is kept on the environ too and a
+    connection reads the store once, not on every event.
+    """
+
+    ENVIRON_KEY = 'chat.session'
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        session = request.environ.get(self.ENVIRON_KEY)
+        if session is None:
+            session = request.environ[self.ENVIRON_KEY] = self._load(app, request)
+        return session
+
+    def _load(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.replaces is not None:
+            self.store.delete(session.replaces)
+            session.replaces = None
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            session.modified = False
+            return
+        if not session.modified:
+            return
+        self.store.set(session.sid, session)
+        if session.new:
+            response.set_cookie(name, session.sid, domain=domain, path=path,
+                                httponly=self.get_cookie_httponly(app),
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+        # A Socket.IO connection keeps this object for its next event
+        session.modified = session.new = False
@@ -0,0 +1,105 @@
+const socket = io();
+let room = '';
+let lastSid = null;  // our sid before a reconnect, to resume the conversation
+let seen = 0;        // last message seq received from the stranger
+const input = document.getElementById('input');
+const sendBtn = document.getElementById('send');
+
+socket.on('connect', () => {
+    if (room && lastSid) socket.emit('resume', { room, sid: lastSid, seen });
+    else socket.emit('join');
+    lastSid = socket.id;
+});
+
+socket.on('disconnect', () => {
+    input.disabled = true;
+    sendBtn.disabled = true;
+});
+socket.on('partner-found', data => {
+    console.log("Partner-found data:", data);
+    room = data && data.room;
+    seen = 0;
+
+    const controls = document.querySelector('.chat-controls');
+
+    if (room) {
+        append("System: Connected to a stranger", 'system');
+        controls.style.display = 'flex';
+        input.disabled = false;
+        sendBtn.disabled = false;
+    } else {
+        append("System: Waiting for a match...", 'system');
+        controls.style.display = 'none';
+        input.disabled = true;
+        sendBtn.disabled = true;
+    }
+});
+
+socket.on('resumed', data => {
+    data.messages.forEach(m => {
+        seen = Math.max(seen, m.seq);
+        append("Stranger: " + m.message, 'stranger');
+    });
+    input.disabled = false;
+    sendBtn.disabled = false;
+});
+
+socket.on('partner-back', () => setTyping(false));
+
+socket.on('partner-left', () => {
+    room = '';
+    setTyping(false);
+    append("System: Stranger has disconnected", 'system');
+    socket.emit('join');
+});
+
+socket.on('message', data => {
+    if (data.seq) seen = data.seq;
+    setTyping(false);
+    append("Stranger: " + data.message, 'stranger');
+});
+
+let typingTimer = null;
+function setTyping(active) {
+    clearTimeout(typingTimer);
+    document.getElementById('typing').innerText = active ? "Stranger is typing..." : "";
+    // Fallback in case the stop signal is lost
+    if (active) typingTimer = setTimeout(() => setTyping(false), 5000);
+}
+
+socket.on('typing', () => setTyping(true));
+socket.on('stop-typing', () => setTyping(false));
+
+socket.on('rate-limited', data => {
+    if (data.event === 'message') append("System: Slow down, you're sending messages too fast", 'system');
+    if (data.event === 'skip') append("System: Please wait a moment before skipping again", 'system');
+});
+
+document.getElementById('send').onclick = sendMsg;
+document.getElementById('skip').onclick = () => {
+    socket.emit('skip', { room });
+    document.getElementById('chat-box').innerHTML = '';
+};
+
+input.addEventListener('keypress', e => {
+    if (e.key === 'Enter') sendMsg();
+    else socket.emit('typing', { room });
+});
+
+function sendMsg() {
+    const val = input.value;
+    if (val.trim() && room) {
+        append("You: " + val, 'you');
+        socket.emit('message', { message: val, room });
+        input.value = '';
+    }
+}
+
+function append(text, cls) {
+    const div = document.createElement('div');
+    div.innerText = text;
+    div.className = 'message ' + cls;
+    const box = document.getElementById('chat-box');
+    box.appendChild(div);
+    box.scrollTop = box.scrollHeight;
+}
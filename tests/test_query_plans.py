@@ -0,0 +1,107 @@
+"""The hot queries must stay on indexes, on a fresh database and on one
+migrated from the original schema."""
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import bench
+from db import Database
+from migrations import MIGRATIONS, migrate, schema_version
+
+
+def query_plan(conn, sql, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+@pytest.fixture(scope='module')
+def seeded_db():
+    path = bench.temp_db()
+    bench.seed_preferences(path, 1000)
+    try:
+        with bench.app.db.connection() as conn:
+            conn.execute("ANALYZE")
+            yield conn
+    finally:
+        bench.app.db.close()
+        os.remove(path)
+
+
+@pytest.mark.parametrize('name, sql, params', bench.HOT_QUERIES, ids=[q[0] for q in bench.HOT_QUERIES])
+def test_hot_query_uses_index(seeded_db, name, sql, params):
+    plan = query_plan(seeded_db, sql, params)
+    assert not [step for step in plan if bench.is_table_scan(step, sql)], plan
+
+
+@pytest.fixture
+def original_db(tmp_path):
+    # A database as the app created it before migrations existed: the first
+    # schema, user_version 0, and the duplicates nothing used to prevent
+    path = str(tmp_path / 'db.sqlite')
+    with sqlite3.connect(path) as conn:
+        conn.executescript(MIGRATIONS[0])
+        conn.executemany("INSERT INTO users (id, username) VALUES (?, ?)",
+                         [(1, 'alice'), (2, 'bob'), (3, 'bob')])
+        conn.executemany("INSERT INTO preferences (user_id, category, preference) VALUES (?, ?, ?)",
+                         [(1, 'interest', 'chess'), (1, 'interest', 'chess'), (1, 'music', 'jazz'),
+                          (2, 'interest', 'chess')])
+    conn.close()
+    return path
+
+
+def test_migrate_existing_database(original_db):
+    db = Database(original_db)
+    with db.connection() as conn:
+        assert migrate(conn) == len(MIGRATIONS)
+        assert schema_version(conn) == len(MIGRATIONS)
+
+        assert conn.execute("SELECT id, username FROM users ORDER BY id").fetchall() == \
+            [(1, 'alice'), (2, 'bob'), (3, 'bob#3')]
+        assert conn.execute("SELECT COUNT(*) FROM preferences").fetchone()[0] == 3
+        assert conn.execute("SELECT category, preference, user_count FROM tags ORDER BY id").fetchall() == \
+            [('interest', 'chess', 2), ('music', 'jazz', 1)]
+        assert dict(conn.execute("SELECT name, value FROM counters")) == {'users': 3, 'preference_users': 2}
+        indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert {'users_username', 'preferences_user', 'preferences_tag', 'tags_user_count'} <= indexes
+
+        # The triggers keep the tags and counters up to date from here on
+        conn.execute("INSERT INTO preferences (user_id, category, preference) VALUES (3, 'music', 'jazz')")
+        assert conn.execute("SELECT user_count FROM tags WHERE preference='jazz'").fetchone()[0] == 2
+        assert dict(conn.execute("SELECT name, value FROM counters"))['preference_users'] == 3
+        conn.commit()
+
+        for name, sql, params in bench.HOT_QUERIES:
+            plan = query_plan(conn, sql, params)
+            assert not [step for step in plan if bench.is_table_scan(step, sql)], (name, plan)
+
+        # Running again is a no-op
+        assert migrate(conn) == len(MIGRATIONS)
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 3
+    db.close()
+
+
+def test_workers_migrating_together(original_db):
+    versions, errors = [], []
+
+    def worker():
+        conn = sqlite3.connect(original_db, timeout=5, check_same_thread=False)
+        try:
+            versions.append(migrate(conn))
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert versions == [len(MIGRATIONS)] * 4
+    with sqlite3.connect(original_db) as conn:
+        # Migration 2 ran once: a second run would have suffixed 'bob#3' again
+        assert conn.execute("SELECT username FROM users WHERE id=3").fetchone()[0] == 'bob#3'
+        assert dict(conn.execute("SELECT name, value FROM counters")) == {'users': 3, 'preference_users': 2}
+    conn.close()
@@ -0,0 +1,40 @@
+"""Server entry point.
+
+Development:
+    python wsgi.py --debug
+
+Production (cooperative workers, thousands of long-lived WebSockets):
+    CHAT_ASYNC_MODE=gevent gunicorn -k gevent -w 1 wsgi:app
+
+CHAT_ASYNC_MODE must be set before anything else is imported so the
+standard library can be monkey-patched first; that is why this module exists
+instead of an `if __name__ == '__main__'` block in app.py.
+"""
+import os
+
+ASYNC_MODE = os.environ.get('CHAT_ASYNC_MODE', 'threading')
+
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+
+from app import app, socketio  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Chat Chat server.")
+    parser.add_argument('--host', default=os.environ.get('CHAT_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CHAT_PORT', 5000)))
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+    socketio.run(app, host=args.host, port=args.port, debug=args.debug,
+                 allow_unsafe_werkzeug=socketio.async_mode == 'threading')
+
+
+if __name__ == '__main__':
+    main()